@@ -1,228 +1,586 @@
-import base64
-from operator import itemgetter
-from typing import Any, AsyncIterator, Dict, List, Union
-from venv import logger
-
-import boto3  # type: ignore[import]
-import httpx
-from langchain.agents import AgentExecutor
-from langchain.agents.openai_functions_agent.base import create_openai_functions_agent
-from langchain.memory import ConversationTokenBufferMemory
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.tools.google_search.tool import GoogleSearchRun
-from langchain.tools.wikipedia.tool import WikipediaQueryRun
-from langchain.utilities.google_search import GoogleSearchAPIWrapper
-from langchain.utilities.wikipedia import WikipediaAPIWrapper
-from langchain_anthropic import ChatAnthropic
-from langchain_community.chat_models.bedrock import BedrockChat
-from langchain_community.chat_models.tongyi import ChatTongyi
+import asyncio
+import logging
+import time
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Set, Tuple, Union
+
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.language_models.llms import BaseLanguageModel
-from langchain_core.messages import HumanMessage
-from langchain_core.runnables import RunnableLambda, RunnablePassthrough
-from langchain_google_genai import (
-    ChatGoogleGenerativeAI,
-    HarmBlockThreshold,
-    HarmCategory,
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import BaseTool
+
+from app.ai_core.compaction import HistoryCompactor
+from app.ai_core.executor import executor
+from app.ai_core.history import (
+    IncrementalTokenBufferMemory,
+    SummarizingTokenBufferMemory,
+    history_store_from_config,
 )
-from langchain_groq.chat_models import ChatGroq
-from langchain_mistralai.chat_models import ChatMistralAI
-from langchain_openai import ChatOpenAI, OpenAI
-
+from app.ai_core.http_client import http_client
+from app.ai_core.image_jobs import image_jobs
+from app.ai_core.images import ImageIngestor
+from app.ai_core.metrics import (
+    MetricsCallbackHandler,
+    SampledTracingHandler,
+    errors_total,
+    history_tokens,
+    registry,
+    timed,
+)
+from app.ai_core.response_cache import ResponseCache, normalize_prompt
+from app.ai_core.router import RouterChatModel
+from app.ai_core.scheduler import RequestScheduler
+from app.ai_core.tokens import token_counter_from_config
 from app.ai_core.tools import (
     DallEAPIWrapperRun,
-    OpenWeatherMapQueryRunEnhanced,
+    LazyTool,
     TwitterTranslatorRun,
+    lazy_tool,
+    limited_tool,
+    time_sensitive,
+    tool_cache,
 )
 from app.config.settings import Settings
 
-google_safety_settings = {
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-}
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
 
+logger = logging.getLogger(__name__)
 
-def text_model_from_config(config: Settings) -> BaseLanguageModel:
-    if config.is_openai:
-        return ChatOpenAI(
-            model=config.openai_model_name,
-            temperature=config.temperature,
-            max_retries=config.max_retries,
-        )
+# provider sdks are imported by the factories below, so only the configured ones are ever loaded
 
-    if config.is_mistral:
-        return ChatMistralAI(
-            temperature=config.temperature, model=config.mistral_model, max_retries=config.max_retries
-        )
+# how to tell a provider is configured, and how to build its model
+ModelFactory = Tuple[Callable[[Settings], bool], Callable[[Settings], BaseLanguageModel]]
 
-    if config.is_google:
-        return ChatGoogleGenerativeAI(  # type: ignore[arg-type,call-arg]
-            model=config.google_api_model,
-            temperature=config.temperature,
-            safety_settings=google_safety_settings,
-            max_retries=config.max_retries,
-        )
 
-    if config.is_groq:
-        return ChatGroq(temperature=0, model=config.groq_model, max_retries=config.max_retries)
+def _openai_model(config: Settings) -> BaseLanguageModel:
+    from langchain_openai import ChatOpenAI
 
-    if config.is_anthropic:
-        return ChatAnthropic(temperature=config.temperature, model_name=config.claude_model)  # type: ignore[call-arg]
+    return ChatOpenAI(
+        model=config.openai_model_name,
+        temperature=config.temperature,
+        max_retries=config.max_retries,
+    )
 
-    if config.is_dashscope:
-        return ChatTongyi(model=config.dashscope_model, max_retries=config.max_retries)  # type: ignore[call-arg]
 
-    if config.is_aws_bedrock:
-        c = boto3.client(
-            service_name=config.aws_bedrock_service_name,
-            region_name=config.aws_bedrock_region_name,
-            aws_access_key_id=config.aws_access_key_id,
-            aws_secret_access_key=config.aws_secret_access_key,
-        )
-        return BedrockChat(
-            client=c,
-            model_id=config.aws_bedrock_model_id,
-            model_kwargs={"temperature": config.temperature},
-        )
+def _openai_vision_model(config: Settings) -> BaseLanguageModel:
+    from langchain_openai import ChatOpenAI
 
-    raise ValueError("Unknown model type.")
+    return ChatOpenAI(model="gpt-4-vision-preview")
 
 
-def vison_model_from_config(config: Settings) -> BaseLanguageModel | None:
-    if config.is_openai:
-        return ChatOpenAI(model="gpt-4-vision-preview")
-
-    if config.is_google:
-        return ChatGoogleGenerativeAI(  # type: ignore[arg-type,call-arg]
-            model=config.google_api_model,
-            temperature=config.temperature,
-            safety_settings=google_safety_settings,
-            max_retries=config.max_retries,
-        )
+def _mistral_model(config: Settings) -> BaseLanguageModel:
+    from langchain_mistralai.chat_models import ChatMistralAI
 
-    if config.is_anthropic:
-        return ChatAnthropic(temperature=config.temperature, model_name=config.claude_model)  # type: ignore[call-arg]
+    return ChatMistralAI(temperature=config.temperature, model=config.mistral_model, max_retries=config.max_retries)
 
-    if config.is_aws_bedrock:
-        c = boto3.client(
-            service_name=config.aws_bedrock_service_name,
-            region_name=config.aws_bedrock_region_name,
-            aws_access_key_id=config.aws_access_key_id,
-            aws_secret_access_key=config.aws_secret_access_key,
-        )
-        return BedrockChat(
-            client=c,
-            model_id=config.aws_bedrock_model_id,
-            model_kwargs={"temperature": config.temperature},
-        )
 
-    return None
+def _google_model(config: Settings) -> BaseLanguageModel:
+    from langchain_google_genai import (
+        ChatGoogleGenerativeAI,
+        HarmBlockThreshold,
+        HarmCategory,
+    )
+
+    google_safety_settings = {
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    }
+    return ChatGoogleGenerativeAI(  # type: ignore[arg-type,call-arg]
+        model=config.google_api_model,
+        temperature=config.temperature,
+        safety_settings=google_safety_settings,
+        max_retries=config.max_retries,
+    )
+
+
+def _groq_model(config: Settings) -> BaseLanguageModel:
+    from langchain_groq.chat_models import ChatGroq
+
+    return ChatGroq(temperature=0, model=config.groq_model, max_retries=config.max_retries)
+
+
+def _anthropic_model(config: Settings) -> BaseLanguageModel:
+    from langchain_anthropic import ChatAnthropic
+
+    return ChatAnthropic(temperature=config.temperature, model_name=config.claude_model)  # type: ignore[call-arg]
+
+
+def _dashscope_model(config: Settings) -> BaseLanguageModel:
+    from langchain_community.chat_models.tongyi import ChatTongyi
+
+    return ChatTongyi(model=config.dashscope_model, max_retries=config.max_retries)  # type: ignore[call-arg]
+
+
+def _bedrock_model(config: Settings) -> BaseLanguageModel:
+    import boto3  # type: ignore[import]
+    from langchain_community.chat_models.bedrock import BedrockChat
+
+    c = boto3.client(
+        service_name=config.aws_bedrock_service_name,
+        region_name=config.aws_bedrock_region_name,
+        aws_access_key_id=config.aws_access_key_id,
+        aws_secret_access_key=config.aws_secret_access_key,
+    )
+    return BedrockChat(
+        client=c,
+        model_id=config.aws_bedrock_model_id,
+        model_kwargs={"temperature": config.temperature},
+    )
+
+
+# providers in order of preference
+text_models: Dict[str, ModelFactory] = {
+    "openai": (lambda config: config.is_openai, _openai_model),
+    "mistral": (lambda config: config.is_mistral, _mistral_model),
+    "google": (lambda config: config.is_google, _google_model),
+    "groq": (lambda config: config.is_groq, _groq_model),
+    "anthropic": (lambda config: config.is_anthropic, _anthropic_model),
+    "dashscope": (lambda config: config.is_dashscope, _dashscope_model),
+    "bedrock": (lambda config: config.is_aws_bedrock, _bedrock_model),
+}
+
+vision_models: Dict[str, ModelFactory] = {
+    "openai": (lambda config: config.is_openai, _openai_vision_model),
+    "google": (lambda config: config.is_google, _google_model),
+    "anthropic": (lambda config: config.is_anthropic, _anthropic_model),
+    "bedrock": (lambda config: config.is_aws_bedrock, _bedrock_model),
+}
+
+
+def _routed_provider(config: Settings, models: Dict[str, ModelFactory]) -> str | None:
+    """The provider whose model _routed_model builds, "router" when it routes between several."""
+    enabled = [name for name, (is_enabled, _) in models.items() if is_enabled(config)]
+    if not enabled:
+        return None
+    if not config.enable_router or len(enabled) == 1:
+        return enabled[0]
+    return "router"
+
+
+def provider_from_config(config: Settings) -> str:
+    """Name of the provider text requests go to, "router" when the router picks one per request."""
+    provider = _routed_provider(config, text_models)
+    if provider is None:
+        raise ValueError("Unknown model type.")
+    return provider
+
+
+def _routed_model(config: Settings, models: Dict[str, ModelFactory]) -> BaseLanguageModel | None:
+    provider = _routed_provider(config, models)
+    if provider is None:
+        return None
+    if provider != "router":
+        return models[provider][1](config)
+    enabled = {name: factory for name, (is_enabled, factory) in models.items() if is_enabled(config)}
+    return RouterChatModel(
+        models={name: factory(config) for name, factory in enabled.items()},  # type: ignore[misc]
+        timeout=config.router_timeout,
+        hedge_after=config.router_hedge_after,
+        failure_threshold=config.router_failure_threshold,
+        cooldown=config.router_cooldown,
+    )
+
+
+def text_model_from_config(config: Settings) -> BaseLanguageModel:
+    model = _routed_model(config, text_models)
+    if model is None:
+        raise ValueError("Unknown model type.")
+    return model
+
+
+def vison_model_from_config(config: Settings) -> BaseLanguageModel | None:
+    return _routed_model(config, vision_models)
+
+
+def vision_provider_from_config(config: Settings) -> str | None:
+    return _routed_provider(config, vision_models)
 
 
 def dalle_model_from_config(config: Settings) -> BaseLanguageModel | None:
     if config.is_openai:
+        from langchain_openai import OpenAI
+
         return OpenAI(temperature=config.temperature, max_retries=config.max_retries)
 
     return None
 
 
+def summary_model_from_config(config: Settings, text_model: BaseLanguageModel) -> BaseLanguageModel:
+    """The model that writes history summaries: history_summary_model on openai, else the chat model."""
+    if config.history_summary_model and config.is_openai:
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(model=config.history_summary_model, temperature=0, max_retries=config.max_retries)
+    return text_model
+
+
+def tools_from_config(config: Settings, dalle_model: BaseLanguageModel | None) -> Tuple[BaseTool, ...]:
+    tools: List[BaseTool] = []
+    if config.enable_google_search:
+        from langchain.tools.google_search.tool import GoogleSearchRun
+        from langchain.utilities.google_search import GoogleSearchAPIWrapper
+
+        tools.append(
+            lazy_tool(
+                GoogleSearchRun,
+                lambda: GoogleSearchRun(api_wrapper=GoogleSearchAPIWrapper()),  # type: ignore[call-arg]
+                metadata=time_sensitive,
+            )
+        )
+    if config.enable_wikipedia:
+        from langchain.tools.wikipedia.tool import WikipediaQueryRun
+        from langchain.utilities.wikipedia import WikipediaAPIWrapper
+
+        tools.append(
+            lazy_tool(WikipediaQueryRun, lambda: WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()))  # type: ignore[call-arg]
+        )
+    if config.openweathermap_api_key:
+        from app.ai_core.weather import OpenWeatherMapQueryRunEnhanced
+
+        tools.append(lazy_tool(OpenWeatherMapQueryRunEnhanced, OpenWeatherMapQueryRunEnhanced, metadata=time_sensitive))
+    if dalle_model:
+        tools.append(DallEAPIWrapperRun(client=dalle_model, metadata=time_sensitive))  # type: ignore[call-arg]
+    if config.enable_twitter_translator:
+        tools.append(TwitterTranslatorRun(metadata=time_sensitive))
+    return tuple(tools)
+
+
+def response_cache_from_config(config: Settings) -> ResponseCache | None:
+    if not config.enable_response_cache:
+        return None
+    embeddings = None
+    if config.response_cache_semantic and config.is_openai:
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings()
+    return ResponseCache(
+        ttl=config.response_cache_ttl,
+        maxsize=config.response_cache_max_entries,
+        sqlite_path=config.response_cache_sqlite_path,
+        embeddings=embeddings,
+        similarity_threshold=config.response_cache_similarity_threshold,
+    )
+
+
+system_prompt = "You are a helpful AI assistant. Note: Always reply in the language that the user uses. For example, if a user uses Chinese, you must respond in Chinese. This is very important to me. If you don't respond according to my instructions, I might lose my job!"
+
+
 class LLMAgentExecutor:
     prompt = ChatPromptTemplate.from_messages(
         [
-            (
-                "system",
-                "You are a helpful AI assistant. Note: Always reply in the language that the user uses. For example, if a user uses Chinese, you must respond in Chinese. This is very important to me. If you don't respond according to my instructions, I might lose my job!",
-            ),
+            ("system", system_prompt + "{context}"),
+            MessagesPlaceholder(variable_name="history"),
+            ("human", "{input}"),
+        ]
+    )
+    agent_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt + "{context}"),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
         ]
     )
-    history = dict[str, ConversationTokenBufferMemory]()
 
     def __init__(self, config: Settings):
         self.text_model = text_model_from_config(config=config)
+        self.provider = provider_from_config(config)
         self.vision_model = vison_model_from_config(config=config)
+        self.vision_provider = vision_provider_from_config(config)
         self.dalle_model = dalle_model_from_config(config=config)
         self.config = config
         self.history_max_size = config.history_max_size
-
-    def get_history(self, user: str) -> ConversationTokenBufferMemory:
-        m = self.history.get(
-            user,
-            ConversationTokenBufferMemory(
-                llm=self.text_model,
-                return_messages=True,
-                max_token_limit=self.history_max_size,
-                memory_key="history",
-                output_key="output",  # for hacky reasons
-            ),
+        self.token_counter = token_counter_from_config(config)
+        self.history = history_store_from_config(config, self._new_history)
+        self.compactor = (
+            HistoryCompactor(
+                summary_model_from_config(config, self.text_model),
+                self.history,
+                max_summary_tokens=config.history_summary_max_tokens,
+            )
+            if config.history_mode == "summary"
+            else None
+        )
+        self.tools = tools_from_config(config, self.dalle_model)
+        self.time_sensitive_tools = {t.name for t in self.tools if (t.metadata or {}).get("time_sensitive")}
+        self.response_cache = response_cache_from_config(config)
+        self.model_id = f"{self.provider}:{config.temperature}:{self.text_model._identifying_params}"
+        http_client.configure(
+            max_connections=config.http_max_connections,
+            timeout=config.http_timeout,
+            max_concurrency=config.http_max_concurrency,
         )
-        self.history[user] = m
-        return m
+        tool_cache.ttl = config.tool_cache_ttl
+        image_jobs.configure(
+            max_workers=config.image_job_workers,
+            max_queue_depth=config.image_job_max_queue,
+            cache_ttl=config.image_job_cache_ttl,
+        )
+        executor.configure(
+            threads=config.executor_threads,
+            cpu_kind=config.cpu_executor,
+            cpu_workers=config.cpu_executor_workers,
+        )
+        self.images = ImageIngestor(
+            max_download_bytes=config.image_max_download_bytes,
+            max_side=config.image_max_side,
+            max_bytes=config.image_max_bytes,
+            cache_ttl=config.image_cache_ttl,
+            cache_bytes=config.image_cache_bytes,
+        )
+        self.scheduler = RequestScheduler(
+            max_in_flight=config.scheduler_max_in_flight,
+            max_queue_depth=config.scheduler_max_queue_depth,
+            provider_limits=config.scheduler_provider_limits,
+            max_user_queue=config.scheduler_max_user_queue,
+        )
+        # with a router, llm calls are only limited per provider once it picked one
+        for model in (self.text_model, self.vision_model):
+            if isinstance(model, RouterChatModel):
+                model.limiter = self.scheduler.provider_slot
+        self.callbacks: List[BaseCallbackHandler] = [MetricsCallbackHandler(self.token_counter)]
+        if config.trace_sample_rate > 0:
+            self.callbacks.append(SampledTracingHandler(config.trace_sample_rate))
+        self._register_metrics()
+
+    def _register_metrics(self):
+        registry.gauge(
+            "aiverse_scheduler",
+            "Request scheduler state.",
+            ["state"],
+            lambda: {(k,): v for k, v in self.scheduler.stats().items()},
+        )
+        registry.gauge(
+            "aiverse_history",
+            "Resident chat histories.",
+            ["kind"],
+            lambda: {("users",): len(self.history), ("bytes",): self.history.total_bytes},
+        )
+        registry.gauge(
+            "aiverse_cache",
+            "Cache lookups by cache and result.",
+            ["cache", "result"],
+            lambda: {
+                ("tool", "hit"): tool_cache.hits,
+                ("tool", "miss"): tool_cache.misses,
+                **(
+                    {
+                        ("response", "hit"): self.response_cache.hits,
+                        ("response", "semantic_hit"): self.response_cache.semantic_hits,
+                        ("response", "miss"): self.response_cache.misses,
+                    }
+                    if self.response_cache
+                    else {}
+                ),
+            },
+        )
+        if self.response_cache:
+            response_cache = self.response_cache
+            registry.gauge(
+                "aiverse_response_cache_saved_seconds",
+                "LLM time saved by answering from the response cache, as measured when each answer was cached.",
+                [],
+                lambda: {(): response_cache.saved_seconds},
+            )
+
+    @cached_property
+    def agent_executor(self) -> "AgentExecutor | None":
+        """The tool-calling agent, built once and shared by all requests."""
+        if not (self.config.is_openai and self.tools):
+            return None
+        from langchain.agents import AgentExecutor
+
+        model = self.text_model.models["openai"] if isinstance(self.text_model, RouterChatModel) else self.text_model
+        tools: List[BaseTool] = list(self.tools)
+        if self.config.agent_mode == "tools":
+            # several tool calls per model turn, which AgentExecutor's async path runs concurrently
+            from langchain.agents.openai_tools.base import create_openai_tools_agent
+
+            limiter = asyncio.Semaphore(self.config.agent_max_tool_calls)
+            timeouts = self.config.agent_tool_timeouts
+            tools = [limited_tool(t, timeouts.get(t.name, self.config.agent_tool_timeout), limiter) for t in tools]
+            agent = create_openai_tools_agent(model, tools, self.agent_prompt)
+        else:
+            from langchain.agents.openai_functions_agent.base import create_openai_functions_agent
+
+            agent = create_openai_functions_agent(model, tools, self.agent_prompt)
+        return AgentExecutor(agent=agent, tools=tools, verbose=True)  # type: ignore[arg-type]
+
+    def _warm_up(self):
+        self.agent_executor
+        for tool in self.tools:
+            if isinstance(tool, LazyTool):
+                tool.tool
+
+    async def warm_up(self):
+        """Build the agent and the lazy tools ahead of the first request."""
+        await asyncio.get_running_loop().run_in_executor(None, self._warm_up)
+
+    def _new_history(self) -> IncrementalTokenBufferMemory:
+        memory_cls = IncrementalTokenBufferMemory
+        if self.config.history_mode == "summary":
+            memory_cls = SummarizingTokenBufferMemory
+        return memory_cls(
+            token_counter=self.token_counter,
+            return_messages=True,
+            max_token_limit=self.history_max_size,
+            memory_key="history",
+            output_key="output",  # for hacky reasons
+        )
+
+    def get_history(self, user: str) -> IncrementalTokenBufferMemory:
+        return self.history.get(user)
+
+    def _load_history(self, user: str) -> Tuple[IncrementalTokenBufferMemory, Dict[str, Any]]:
+        memory = self.get_history(user)
+        return memory, memory.load_memory_variables({})
+
+    async def clear_history(self, user: str):
+        await executor.run(self.history.clear, user)
+
+    async def save_history(self, user: str, input: str, response: str):
+        """Add a turn to the history of `user`; tokenizing and trimming run on the executor."""
+        with timed("history.save"):
+            memory = await executor.run(self.history.save, user, input, response)
+        if self.compactor and isinstance(memory, SummarizingTokenBufferMemory):
+            self.compactor.schedule(user, memory)
+
+    async def _vision_content(self, message: List[Union[str, Dict]]) -> List[Union[str, Dict]]:
+        """Turn the image parts of a message into what the vision model accepts, fetching them concurrently."""
+
+        async def resolve(part: Union[str, Dict]) -> Union[str, Dict]:
+            if not isinstance(part, dict) or part.get("type") != "image_url" or isinstance(part["image_url"], dict):
+                return part
+            if self.vision_provider == "openai":
+                return {"type": "image_url", "image_url": {"url": part["image_url"]}}
+            if self.vision_provider == "google":
+                return part
+            # anthropic and bedrock only take inline images, which every vision provider behind a router accepts
+            return {"type": "image_url", "image_url": {"url": await self.images.data_url(part["image_url"])}}
+
+        return list(await asyncio.gather(*[resolve(p) for p in message]))
+
+    async def query_images(self, user: str, text: str, image_urls: List[str]) -> AsyncIterator[str]:
+        """Ask about several images, either in one multimodal message or as concurrent per-image queries."""
+        text_part: List[Union[str, Dict]] = [{"type": "text", "text": text}] if text else []
+        if self.config.vision_multi_image or len(image_urls) == 1:
+            async for s in self.query(user, text_part + [{"type": "image_url", "image_url": u} for u in image_urls]):
+                yield s
+            return
 
-    def clear_history(self, user: str):
-        if user in self.history:
-            self.history[user].clear()
+        semaphore = asyncio.Semaphore(self.config.vision_max_concurrency)
 
-    def save_history(self, user: str, input: str, response: str):
-        self.get_history(user).save_context({"input": input}, {"output": response})
+        async def ask(url: str) -> str:
+            async with semaphore:
+                response = self.query(user, text_part + [{"type": "image_url", "image_url": url}])
+                return "".join([s async for s in response])
 
-    async def query(self, user: str, message: Union[str, List[Union[str, Dict]]]) -> AsyncIterator[str]:
-        logger.info(f"Querying {user} with {message}")
+        tasks = [asyncio.create_task(ask(u)) for u in image_urls]
+        try:
+            for i, task in enumerate(tasks):
+                separator = "\n\n" if i else ""
+                yield f"{separator}**Image {i + 1}**\n{await task}"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def query(
+        self, user: str, message: Union[str, List[Union[str, Dict]]], context: str = ""
+    ) -> AsyncIterator[str]:
+        """Answer `message`; `context` is shown to the model but not kept in the history."""
+        logger.debug("Querying %s with %s", user, message)
         if isinstance(message, list):
             if self.vision_model:
-                if isinstance(self.vision_model, ChatAnthropic) or isinstance(self.vision_model, BedrockChat):
-                    async with httpx.AsyncClient() as client:
-                        r = await client.get(message[1].get("image_url"))  # type: ignore[arg-type,union-attr]
-                        img_base64 = base64.b64encode(r.content).decode("utf-8")
-                        message[1]["image_url"] = {"url": f"data:image/png;base64,{img_base64}"}  # type: ignore[index]
-                elif isinstance(self.vision_model, ChatOpenAI):
-                    message[1]["image_url"] = {"url": message[1].get("image_url")}  # type: ignore[index,union-attr]
-                msg = HumanMessage(content=message)
-                async for s in self.vision_model.astream([msg]):
+                with timed("images.fetch"):
+                    msg = HumanMessage(content=await self._vision_content(message))
+                async for s in self.vision_model.astream([msg], config={"callbacks": self.callbacks}):
                     yield s.content  # type: ignore
                 return
             raise ValueError("Vision model is not enabled")
 
-        memory = self.get_history(user)
+        with timed("history.load"):
+            memory, variables = await executor.run(self._load_history, user)
+        # only answers that don't depend on a conversation are shared, follow-ups are not
+        if (
+            self.response_cache is None
+            or context
+            or memory.buffer
+            or variables.get("summary")
+            or len(normalize_prompt(message)) < self.config.response_cache_min_length
+        ):
+            async for s in self._query_text(message, memory, variables, set(), context):
+                yield s
+            return
 
-        tools: List[Any] = []
-        if self.config.enable_google_search:
-            tools.append(GoogleSearchRun(api_wrapper=GoogleSearchAPIWrapper()))  # type: ignore[call-arg]
-        if self.config.enable_wikipedia:
-            tools.append(WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper()))  # type: ignore[call-arg]
-        if self.config.openweathermap_api_key:
-            tools.append(OpenWeatherMapQueryRunEnhanced())
-        if self.dalle_model and isinstance(self.dalle_model, OpenAI):
-            tools.append(DallEAPIWrapperRun(client=self.dalle_model))  # type: ignore[call-arg]
-        if self.config.enable_twitter_translator:
-            tools.append(TwitterTranslatorRun())
-
-        if self.config.is_openai and len(tools) > 0:
-            self.prompt.append(MessagesPlaceholder(variable_name="agent_scratchpad"))
-            # self.prompt.append can't update input_variables, so need this
-            self.prompt.input_variables.append("agent_scratchpad")
-            agent = create_openai_functions_agent(self.text_model, tools, self.prompt)
-            agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)  # type: ignore[arg-type]
+        try:
+            cached = await self.response_cache.aget(message, self.model_id)
+        except Exception as e:
+            logger.warning(f"Response cache lookup failed: {e}")
+            cached = None
+        if cached is not None:
+            yield cached
+            return
+
+        started = time.monotonic()
+        chunks: List[str] = []
+        uncacheable: Set[str] = set()
+        async for s in self._query_text(message, memory, variables, uncacheable):
+            chunks.append(s)
+            yield s
+        if uncacheable:
+            logger.info(f"Not caching response: {', '.join(uncacheable)}")
+            return
+        try:
+            await self.response_cache.aput(message, self.model_id, "".join(chunks), time.monotonic() - started)
+        except Exception as e:  # the answer was already sent
+            logger.warning(f"Caching the response failed: {e}")
+
+    async def _query_text(
+        self,
+        message: str,
+        memory: IncrementalTokenBufferMemory,
+        variables: Dict[str, Any],
+        uncacheable: Set[str],
+        context: str = "",
+    ) -> AsyncIterator[str]:
+        """Answer a text message, noting in `uncacheable` why the answer must not be reused."""
+        history_tokens.observe(memory.total_tokens)
+        history: List[BaseMessage] = variables[memory.memory_key]
+        # appended to the system prompt: some providers only accept a leading system message
+        system_context = ""
+        if variables.get("summary"):
+            system_context += f"\n\nSummary of the earlier conversation: {variables['summary']}"
+        if context:
+            system_context += f"\n\nRecent messages in this channel:\n{context}"
+
+        agent_executor = self.agent_executor
+        if agent_executor:
             async for v in agent_executor.astream(
-                {"input": message, "history": memory.load_memory_variables({})[memory.memory_key]}
+                {"input": message, "history": history, "context": system_context}, config={"callbacks": self.callbacks}
             ):
+                if isinstance(v, dict) and "actions" in v:
+                    uncacheable.update(a.tool for a in v["actions"] if a.tool in self.time_sensitive_tools)
                 if isinstance(v, dict) and "output" in v:
                     yield v["output"]
             return
 
-        chain = (
-            RunnablePassthrough.assign(history=RunnableLambda(memory.load_memory_variables) | itemgetter("history"))
-            | self.prompt
-            | self.text_model
-        )
+        chain = self.prompt | self.text_model
 
         try:
-            c = await chain.ainvoke({"input": message})
-            yield c.content
+            async for c in chain.astream(
+                {"input": message, "history": history, "context": system_context}, config={"callbacks": self.callbacks}
+            ):
+                yield c.content
         except KeyError as e:
+            uncacheable.add("error")
+            errors_total.inc(stage="query", error=type(e).__name__)
             if "HarmCategory." in str(e):  # gemini safety errors, retutn some sorry emoji
                 yield "Based on safety principles, I am unable to respond to your request. 😢"
         except Exception as e:
+            uncacheable.add("error")
+            errors_total.inc(stage="query", error=type(e).__name__)
             yield f"An error occurred: {e}"
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+import sys
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """A thread-safe LRU cache whose entries expire `ttl` seconds after they are set.
+
+    Besides `maxsize` entries, the cache can hold at most `max_bytes` (0 for no limit) as measured
+    by `sizeof`; values larger than that on their own aren't cached.
+    """
+
+    def __init__(
+        self, maxsize: int = 1024, ttl: float = 300, max_bytes: int = 0, sizeof: Callable[[V], int] = sys.getsizeof
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data: OrderedDict[K, Tuple[float, V, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] > time.monotonic()
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None):
+        size = self.sizeof(value) if self.max_bytes > 0 else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.max_bytes > 0 and size > self.max_bytes:
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes > 0 and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        with self._lock:
+            item = self._remove(key)
+            return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key: K) -> Optional[Tuple[float, V, int]]:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[2]
+        return item
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Set
+
+from langchain_core.language_models.llms import BaseLanguageModel
+from langchain_core.messages import get_buffer_string
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.ai_core.executor import executor
+from app.ai_core.history import HistoryStore, SummarizingTokenBufferMemory, message_id
+from app.ai_core.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryCompactor:
+    """Folds the messages pruned from summarizing memories into their summary, off the request path.
+
+    Each run only summarizes the messages pruned since the last one, together with the previous
+    summary, so its cost does not grow with the length of the conversation.
+    """
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                "Progressively summarize a conversation between a user and an AI assistant. Merge the new "
+                "lines into the previous summary, keeping names, facts, preferences, decisions and open "
+                "questions. Write at most {max_words} words, in the language of the conversation, and reply "
+                "with the summary only.",
+            ),
+            ("human", "Previous summary:\n{summary}\n\nNew lines:\n{lines}"),
+        ]
+    )
+
+    def __init__(self, model: BaseLanguageModel, store: HistoryStore, max_summary_tokens: int = 300):
+        self.chain = self.prompt | model
+        self.store = store
+        self.max_summary_tokens = max_summary_tokens
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, user: str, memory: SummarizingTokenBufferMemory):
+        """Start compacting `memory` in the background if it has pruned messages and isn't already."""
+        if not memory.pending or memory.compacting:
+            return
+        memory.compacting = True
+        task = asyncio.create_task(self.compact(user, memory))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def compact(self, user: str, memory: SummarizingTokenBufferMemory):
+        try:
+            while memory.pending:
+                batch, generation = list(memory.pending), memory.generation
+                with timed("history.compact"):
+                    result = await self.chain.ainvoke(
+                        {
+                            "summary": memory.summary or "(none)",
+                            "lines": get_buffer_string(batch),
+                            "max_words": self.max_summary_tokens * 3 // 4,
+                        }
+                    )
+                summary = str(getattr(result, "content", result)).strip()[: self.max_summary_tokens * 4]
+                if memory.generation != generation:  # cleared meanwhile
+                    break
+                covered = max(memory.covered, message_id(batch[-1]))
+                if not await executor.run(self.store.save_summary, user, summary, covered, memory.covered):
+                    # another worker compacted this user first; its summary is picked up on the next load
+                    logger.info(f"History of {user} was compacted elsewhere, dropping this summary")
+                    break
+                if memory.generation != generation:
+                    break
+                memory.fold(summary, batch, covered)
+        except Exception as e:  # the messages stay pending and are retried after the next turn
+            logger.warning(f"Compacting the history of {user} failed: {e}")
+        finally:
+            memory.compacting = False
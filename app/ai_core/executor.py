@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app.ai_core.metrics import loop_lag_seconds
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BlockingExecutor:
+    """Pools that keep blocking and CPU-bound work off the event loop.
+
+    Blocking calls that touch in-process state (history, sqlite, sync SDK clients) go to a thread
+    pool, which is also installed as the loop's default executor so `run_in_executor(None, ...)`
+    inside langchain uses it. Pure functions of picklable arguments can go to a separate CPU pool,
+    which is either threads or processes. Both are created lazily.
+    """
+
+    def __init__(self, threads: int = 8, cpu_kind: str = "thread", cpu_workers: int = 2):
+        self.configure(threads, cpu_kind, cpu_workers)
+        self._io: ThreadPoolExecutor | None = None
+        self._cpu: Executor | None = None
+
+    def configure(self, threads: int = 8, cpu_kind: str = "thread", cpu_workers: int = 2):
+        """Change the pool sizes; takes effect the next time the pools are created."""
+        if cpu_kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {cpu_kind}")
+        self.threads = threads
+        self.cpu_kind = cpu_kind
+        self.cpu_workers = cpu_workers
+
+    @property
+    def io(self) -> ThreadPoolExecutor:
+        if self._io is None:
+            self._io = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="blocking")
+        return self._io
+
+    @property
+    def cpu(self) -> Executor:
+        if self._cpu is None:
+            if self.cpu_kind == "process":
+                self._cpu = ProcessPoolExecutor(max_workers=self.cpu_workers)
+            else:
+                self._cpu = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix="cpu")
+        return self._cpu
+
+    def install(self, loop: asyncio.AbstractEventLoop | None = None):
+        """Make the thread pool the default executor of `loop`, the running loop by default."""
+        (loop or asyncio.get_running_loop()).set_default_executor(self.io)
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Call `fn` on the thread pool, keeping the caller's context variables."""
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.io, call)
+
+    async def run_cpu(self, fn: Callable[..., T], *args: Any) -> T:
+        """Call `fn` on the CPU pool; with processes, `fn` and `args` must be picklable."""
+        return await asyncio.get_running_loop().run_in_executor(self.cpu, functools.partial(fn, *args))
+
+    def shutdown(self):
+        for pool in (self._io, self._cpu):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._io = self._cpu = None
+
+
+executor = BlockingExecutor()
+
+
+async def monitor_loop_lag(threshold: float = 0.1, interval: float = 0.05):
+    """Log whenever the running loop was blocked for more than `threshold` seconds."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = time.monotonic() - started - interval
+        loop_lag_seconds.observe(max(lag, 0.0))
+        if lag > threshold:
+            logger.warning("event loop was blocked for %.3fs", lag)
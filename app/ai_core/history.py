@@ -0,0 +1,404 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.memory import BaseMemory
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    get_buffer_string,
+    messages_from_dict,
+    messages_to_dict,
+)
+from langchain_core.pydantic_v1 import Field
+
+from app.ai_core.tokens import TokenCounter
+from app.config.settings import Settings
+
+
+def message_size(message: BaseMessage) -> int:
+    """Approximate resident size of a message, used for the global memory budget."""
+    if isinstance(message.content, str):
+        return len(message.content.encode("utf-8"))
+    return len(str(message.content))
+
+
+class IncrementalTokenBufferMemory(BaseMemory):
+    """Token-limited buffer that counts each message once, when it is appended.
+
+    Unlike ConversationTokenBufferMemory, saving a turn does not re-tokenize the whole buffer:
+    per-message counts are cached next to the messages and a running total decides how many of
+    the oldest messages to drop. Built on langchain_core alone, since importing langchain.memory
+    loads most of langchain_community.
+    """
+
+    chat_memory: BaseChatMessageHistory = Field(default_factory=InMemoryChatMessageHistory)
+    input_key: str = "input"
+    output_key: str = "output"
+    token_counter: TokenCounter
+    max_token_limit: int = 2000
+    memory_key: str = "history"
+    return_messages: bool = True
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    token_counts: List[int] = []
+    total_tokens: int = 0
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def buffer(self) -> List[BaseMessage]:
+        return self.chat_memory.messages
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if self.return_messages:
+            return {self.memory_key: list(self.buffer)}
+        return {
+            self.memory_key: get_buffer_string(self.buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        }
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        self.add_messages([HumanMessage(content=inputs[self.input_key]), AIMessage(content=outputs[self.output_key])])
+
+    def add_messages(self, messages: Sequence[BaseMessage]):
+        if len(self.token_counts) != len(self.buffer):  # buffer was changed behind our back
+            self.token_counts = [self.token_counter(m) for m in self.buffer]
+            self.total_tokens = sum(self.token_counts)
+        for m in messages:
+            n = self.token_counter(m)
+            self.chat_memory.add_message(m)
+            self.token_counts.append(n)
+            self.total_tokens += n
+        self.prune()
+
+    def prune(self) -> List[BaseMessage]:
+        """Drop the oldest messages until the buffer fits `max_token_limit`, returning them."""
+        drop = 0
+        while drop < len(self.token_counts) and self.total_tokens > self.max_token_limit:
+            self.total_tokens -= self.token_counts[drop]
+            drop += 1
+        if not drop:
+            return []
+        pruned = self.buffer[:drop]
+        del self.buffer[:drop]
+        del self.token_counts[:drop]
+        return pruned
+
+    def clear(self) -> None:
+        self.chat_memory.clear()
+        self.token_counts = []
+        self.total_tokens = 0
+
+
+class SummarizingTokenBufferMemory(IncrementalTokenBufferMemory):
+    """A token buffer that keeps what it prunes for a rolling summary instead of forgetting it.
+
+    Pruned messages wait in `pending` until a HistoryCompactor folds them into `summary`, which
+    covers the backend's messages up to id `covered` (0 without a backend). With
+    `return_messages` the summary is returned as its own `summary` variable, for the leading system
+    message: several providers reject system messages anywhere else. `generation` changes on every
+    clear, so a compaction that was running at the time can tell its summary is stale. While
+    compaction keeps failing, at most `max_pending` messages wait and older ones are forgotten.
+    """
+
+    summary: str = ""
+    covered: int = 0
+    pending: List[BaseMessage] = []
+    compacting: bool = False
+    generation: int = 0
+    max_pending: int = 100
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key, "summary"]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if self.return_messages:
+            return {self.memory_key: list(self.buffer), "summary": self.summary}
+        if not self.summary:
+            return super().load_memory_variables(inputs)
+        buffer = get_buffer_string(self.buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        return {self.memory_key: f"Summary of the earlier conversation: {self.summary}\n{buffer}"}
+
+    def prune(self) -> List[BaseMessage]:
+        pruned = super().prune()
+        self.pending.extend(pruned)
+        if len(self.pending) > self.max_pending:
+            del self.pending[: len(self.pending) - self.max_pending]
+        return pruned
+
+    def fold(self, summary: str, batch: Sequence[BaseMessage], covered: int = 0):
+        """Replace the summary by one that also covers the pending messages of `batch`."""
+        self.summary = summary
+        self.covered = covered
+        folded = {id(m) for m in batch}
+        self.pending = [m for m in self.pending if id(m) not in folded]
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = ""
+        self.covered = 0
+        self.pending = []
+        self.generation += 1
+
+
+def message_id(message: BaseMessage) -> int:
+    """The backend id of a message, 0 when it wasn't stored."""
+    return int(message.id) if message.id else 0
+
+
+MemoryFactory = Callable[[], IncrementalTokenBufferMemory]
+
+
+class HistoryBackend(ABC):
+    """Durable storage that evicted or restarted sessions are rehydrated from."""
+
+    @abstractmethod
+    def load(self, user: str, limit: int, after: int = 0) -> List[BaseMessage]:
+        """Return up to `limit` most recent messages of `user` with ids above `after`, oldest first."""
+
+    @abstractmethod
+    def append(self, user: str, messages: Sequence[BaseMessage]):
+        """Append messages to the history of `user`, setting their ids."""
+
+    @abstractmethod
+    def clear(self, user: str):
+        """Forget the history of `user`, including the summary."""
+
+    def load_summary(self, user: str) -> Tuple[str, int]:
+        """The rolling summary of the messages of `user` that no longer fit the buffer, and the id of
+        the last message it covers."""
+        return "", 0
+
+    def save_summary(self, user: str, summary: str, covered: int, previous: int) -> bool:
+        """Replace the summary if it still covers up to `previous`; False when another process got there first."""
+        return True
+
+
+class SQLiteHistoryBackend(HistoryBackend):
+    """An append-only message log per user, kept in a single SQLite file."""
+
+    def __init__(self, path: str, max_messages_per_user: int = 200):
+        self.max_messages_per_user = max_messages_per_user
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # other processes may share the file
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, message TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS history_user ON history (user, id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "user TEXT PRIMARY KEY, summary TEXT NOT NULL, covered INTEGER NOT NULL DEFAULT 0)"
+            )
+            if "covered" not in [r[1] for r in self._conn.execute("PRAGMA table_info(summaries)")]:
+                self._conn.execute("ALTER TABLE summaries ADD COLUMN covered INTEGER NOT NULL DEFAULT 0")
+
+    def load(self, user: str, limit: int, after: int = 0) -> List[BaseMessage]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, message FROM (SELECT id, message FROM history WHERE user = ? AND id > ? ORDER BY id DESC LIMIT ?) ORDER BY id",
+                (user, after, limit),
+            ).fetchall()
+        messages = messages_from_dict([json.loads(r[1]) for r in rows])
+        for (id, _), m in zip(rows, messages):
+            m.id = str(id)
+        return messages
+
+    def append(self, user: str, messages: Sequence[BaseMessage]):
+        rows = [(user, json.dumps(m)) for m in messages_to_dict(messages)]
+        with self._lock, self._conn:
+            for m, row in zip(messages, rows):
+                m.id = str(self._conn.execute("INSERT INTO history (user, message) VALUES (?, ?)", row).lastrowid)
+            self._conn.execute(
+                "DELETE FROM history WHERE user = ? AND id NOT IN "
+                "(SELECT id FROM history WHERE user = ? ORDER BY id DESC LIMIT ?)",
+                (user, user, self.max_messages_per_user),
+            )
+
+    def clear(self, user: str):
+        with self._lock, self._conn:
+            # an empty summary covering everything so far makes compactions still running elsewhere stale
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (user, summary, covered) "
+                "SELECT ?, '', COALESCE(MAX(id), 0) FROM history WHERE user = ?",
+                (user, user),
+            )
+            self._conn.execute("DELETE FROM history WHERE user = ?", (user,))
+
+    def load_summary(self, user: str) -> Tuple[str, int]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary, covered FROM summaries WHERE user = ?", (user,)).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_summary(self, user: str, summary: str, covered: int, previous: int) -> bool:
+        with self._lock, self._conn:
+            if previous:
+                cursor = self._conn.execute(
+                    "UPDATE summaries SET summary = ?, covered = ? WHERE user = ? AND covered = ?",
+                    (summary, covered, user, previous),
+                )
+            else:
+                cursor = self._conn.execute(
+                    "INSERT INTO summaries (user, summary, covered) VALUES (?, ?, ?) ON CONFLICT (user) DO UPDATE "
+                    "SET summary = excluded.summary, covered = excluded.covered WHERE summaries.covered = 0",
+                    (user, summary, covered),
+                )
+            return cursor.rowcount == 1
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class HistoryStore:
+    """Per-user conversation memories with LRU/TTL eviction and a global size budget.
+
+    Memories are only built when a user is first seen (or seen again after eviction); with a
+    backend configured they are rehydrated from it, so eviction only costs a reload. When other
+    processes write to the same backend, `shared` reloads the memory on every access instead.
+    Summarizing memories are rehydrated from their summary plus the messages after it, so
+    messages pruned but not yet summarized are pending again after a reload.
+    """
+
+    def __init__(
+        self,
+        factory: MemoryFactory,
+        max_users: int = 1000,
+        ttl: float = 3600,
+        max_bytes: int = 0,
+        backend: HistoryBackend | None = None,
+        rehydrate_limit: int = 100,
+        shared: bool = False,
+    ):
+        self.factory = factory
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.rehydrate_limit = rehydrate_limit
+        self.shared = shared and backend is not None
+        self._memories: OrderedDict[str, IncrementalTokenBufferMemory] = OrderedDict()
+        self._accessed: dict[str, float] = {}
+        self._sizes: dict[str, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._memories)
+
+    def __contains__(self, user: str) -> bool:
+        return user in self._memories
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, user: str) -> IncrementalTokenBufferMemory:
+        with self._lock:
+            self._evict_expired()
+            m = self._memories.get(user)
+            if m is None or self.shared:
+                m = self._load(user)
+                self._memories[user] = m
+            self._memories.move_to_end(user)
+            self._accessed[user] = time.monotonic()
+            self._resize(user)
+            self._evict_over_budget(keep=user)
+            return m
+
+    def save(self, user: str, input: str, output: str) -> IncrementalTokenBufferMemory:
+        with self._lock:
+            m = self.get(user)
+            messages = [HumanMessage(content=input), AIMessage(content=output)]
+            if self.backend:
+                self.backend.append(user, messages)
+            m.add_messages(messages)
+            self._resize(user)
+            self._evict_over_budget(keep=user)
+            return m
+
+    def save_summary(self, user: str, summary: str, covered: int, previous: int) -> bool:
+        if self.backend:
+            return self.backend.save_summary(user, summary, covered, previous)
+        return True
+
+    def clear(self, user: str):
+        with self._lock:
+            m = self._memories.get(user)
+            if m is not None:
+                m.clear()
+                self._resize(user)
+            if self.backend:
+                self.backend.clear(user)
+                if isinstance(m, SummarizingTokenBufferMemory):
+                    m.covered = self.backend.load_summary(user)[1]
+
+    def _load(self, user: str) -> IncrementalTokenBufferMemory:
+        m = self.factory()
+        if self.backend:
+            summary, covered = "", 0
+            if isinstance(m, SummarizingTokenBufferMemory):
+                summary, covered = self.backend.load_summary(user)
+            messages = self.backend.load(user, self.rehydrate_limit, after=covered)
+            if messages:
+                m.add_messages(messages)
+            if isinstance(m, SummarizingTokenBufferMemory):
+                m.summary, m.covered = summary, covered
+        return m
+
+    def _resize(self, user: str):
+        m = self._memories[user]
+        size = sum(message_size(x) for x in m.chat_memory.messages)
+        if isinstance(m, SummarizingTokenBufferMemory):
+            size += sum(message_size(x) for x in m.pending)
+        self._total_bytes += size - self._sizes.get(user, 0)
+        self._sizes[user] = size
+
+    def _evict(self, user: str):
+        del self._memories[user]
+        del self._accessed[user]
+        self._total_bytes -= self._sizes.pop(user, 0)
+
+    def _evict_expired(self):
+        if self.ttl <= 0:
+            return
+        deadline = time.monotonic() - self.ttl
+        while self._memories:
+            user = next(iter(self._memories))
+            if self._accessed[user] > deadline:
+                break
+            self._evict(user)
+
+    def _evict_over_budget(self, keep: str):
+        while len(self._memories) > 1 and (
+            len(self._memories) > self.max_users or (self.max_bytes > 0 and self._total_bytes > self.max_bytes)
+        ):
+            user = next(iter(self._memories))
+            if user == keep:
+                break
+            self._evict(user)
+
+
+def history_store_from_config(config: Settings, factory: MemoryFactory) -> HistoryStore:
+    if config.job_queue_url and not config.history_sqlite_path:
+        raise ValueError("JOB_QUEUE_URL needs HISTORY_SQLITE_PATH so that workers share history")
+    backend = SQLiteHistoryBackend(config.history_sqlite_path) if config.history_sqlite_path else None
+    return HistoryStore(
+        factory,
+        max_users=config.history_max_users,
+        ttl=config.history_ttl,
+        max_bytes=config.history_max_bytes,
+        backend=backend,
+        shared=bool(config.job_queue_url),
+    )
@@ -0,0 +1,78 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+import httpx
+
+
+class SharedHTTPClient:
+    """A process-wide pooled httpx.AsyncClient with bounded request concurrency.
+
+    The underlying client is created lazily on the running loop, so importing this module
+    never opens connections.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        timeout: float = 10,
+        max_concurrency: int = 20,
+    ):
+        self.configure(max_connections, max_keepalive_connections, keepalive_expiry, timeout, max_concurrency)
+        # transports by url prefix, e.g. to point tools at local stand-in servers
+        self.mounts: Dict[str, httpx.AsyncBaseTransport] | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def configure(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30,
+        timeout: float = 10,
+        max_concurrency: int = 20,
+    ):
+        """Change the pool settings; takes effect the next time the client is created."""
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, 5))
+        self.max_concurrency = max_concurrency
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, follow_redirects=True, mounts=self.mounts
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._client
+
+    @asynccontextmanager
+    async def limit(self) -> AsyncIterator[httpx.AsyncClient]:
+        """Hold one of the concurrency slots, for callers that drive the client themselves."""
+        client = self.client
+        async with self._semaphore:  # type: ignore[union-attr]
+            yield client
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        async with self.limit() as client:
+            return await client.request(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+http_client = SharedHTTPClient()
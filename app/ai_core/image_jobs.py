@@ -0,0 +1,105 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List
+
+from app.ai_core.cache import TTLCache
+from app.ai_core.metrics import registry, timed
+
+# image jobs started while answering the current message; a front end that sets this delivers
+# their results itself, otherwise the tools wait for them
+image_deliveries: ContextVar[List["asyncio.Task[str]"] | None] = ContextVar("image_deliveries", default=None)
+
+
+class ImageJobsBusy(Exception):
+    """Raised instead of queueing when too many image jobs are already waiting."""
+
+
+class ImageJobs:
+    """Runs image generations in the background, at most `max_workers` at a time.
+
+    A job first expands the user's description into an image prompt, then generates the image.
+    Identical expanded prompts share one generation while it runs and reuse its url for
+    `cache_ttl` seconds afterwards.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_depth: int = 16, cache_ttl: float = 600):
+        self.configure(max_workers, max_queue_depth, cache_ttl)
+        self._generating: Dict[str, "asyncio.Task[str]"] = {}
+        self._jobs: set["asyncio.Task[str]"] = set()
+        self.queued = 0
+        self.running = 0
+        self.deduplicated = 0
+
+    def configure(self, max_workers: int = 2, max_queue_depth: int = 16, cache_ttl: float = 600):
+        """Change the limits; the worker count takes effect before the first job."""
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.results: TTLCache[str, str] = TTLCache(maxsize=256, ttl=cache_ttl)
+        self._slots: asyncio.Semaphore | None = None
+
+    def stats(self) -> Dict[str, float]:
+        return {"queued": self.queued, "running": self.running, "deduplicated": self.deduplicated}
+
+    def submit(
+        self, expand: Callable[[], Awaitable[str]], generate: Callable[[str], Awaitable[str]]
+    ) -> "asyncio.Task[str]":
+        """Start a job that resolves to the image url."""
+        if self.max_queue_depth > 0 and self.queued >= self.max_queue_depth:
+            raise ImageJobsBusy(f"{self.queued} images are already waiting")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        waiting = [True]
+        job = asyncio.create_task(self._run(self._slots, waiting, expand, generate))
+        self.queued += 1  # counted right away, so submits in the same tick see each other
+        self._jobs.add(job)
+        job.add_done_callback(self._jobs.discard)
+        job.add_done_callback(lambda _: self._dequeue(waiting))  # also when cancelled before it started
+        return job
+
+    def _dequeue(self, waiting: List[bool]):
+        if waiting[0]:
+            waiting[0] = False
+            self.queued -= 1
+
+    async def _run(
+        self,
+        slots: asyncio.Semaphore,
+        waiting: List[bool],
+        expand: Callable[[], Awaitable[str]],
+        generate: Callable[[str], Awaitable[str]],
+    ) -> str:
+        try:
+            await slots.acquire()
+        finally:
+            self._dequeue(waiting)
+        self.running += 1
+        try:
+            with timed("image.generate"):
+                prompt = await expand()
+                url = self.results.get(prompt)
+                if url is not None:
+                    self.deduplicated += 1
+                    return url
+                task = self._generating.get(prompt)
+                if task is None:
+                    task = asyncio.create_task(generate(prompt))
+                    self._generating[prompt] = task
+                    task.add_done_callback(lambda _: self._generating.pop(prompt, None))
+                else:
+                    self.deduplicated += 1
+                url = await asyncio.shield(task)
+                self.results.set(prompt, url)
+                return url
+        finally:
+            self.running -= 1
+            slots.release()
+
+
+image_jobs = ImageJobs()
+
+registry.gauge(
+    "aiverse_image_jobs",
+    "Background image generations by state.",
+    ["state"],
+    lambda: {(k,): v for k, v in image_jobs.stats().items()},
+)
@@ -0,0 +1,102 @@
+import base64
+import hashlib
+from io import BytesIO
+from typing import Tuple
+
+from app.ai_core.cache import TTLCache
+from app.ai_core.executor import executor
+from app.ai_core.http_client import http_client
+
+_signatures = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_mime(data: bytes) -> str | None:
+    """Detect the image type from its magic bytes."""
+    for signature, mime in _signatures:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def shrink_image(data: bytes, mime: str, max_side: int, max_bytes: int) -> Tuple[bytes, str]:
+    """Downscale and re-encode an image when it exceeds `max_side` pixels or `max_bytes`."""
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as img:
+        if max(img.size) <= max_side and len(data) <= max_bytes:
+            return data, mime
+        img.thumbnail((max_side, max_side))
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        out = BytesIO()
+        if has_alpha:
+            img.convert("RGBA").save(out, format="PNG", optimize=True)
+            data, mime = out.getvalue(), "image/png"
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+            data, mime = out.getvalue(), "image/jpeg"
+    return data, mime
+
+
+class ImageIngestor:
+    """Downloads attachments with a byte cap and turns them into base64 data urls for the vision models.
+
+    Encoded payloads are cached by content hash, at most `cache_bytes` of them, and urls map to
+    the hash, so asking about the same image again skips the download and the re-encode.
+    """
+
+    def __init__(
+        self,
+        max_download_bytes: int,
+        max_side: int,
+        max_bytes: int,
+        cache_ttl: float = 600,
+        cache_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.max_download_bytes = max_download_bytes
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self._by_url: TTLCache[str, str] = TTLCache(maxsize=1024, ttl=cache_ttl)
+        self._by_hash: TTLCache[str, str] = TTLCache(maxsize=1024, ttl=cache_ttl, max_bytes=cache_bytes, sizeof=len)
+
+    async def download(self, url: str) -> bytes:
+        buf = bytearray()
+        async with http_client.limit() as client:
+            async with client.stream("GET", url) as r:
+                r.raise_for_status()
+                length = r.headers.get("content-length")
+                if length and int(length) > self.max_download_bytes:
+                    raise ValueError(f"Image is too large ({length} bytes)")
+                async for chunk in r.aiter_bytes():
+                    buf += chunk
+                    if len(buf) > self.max_download_bytes:
+                        raise ValueError(f"Image is larger than {self.max_download_bytes} bytes")
+        return bytes(buf)
+
+    async def data_url(self, url: str) -> str:
+        if url.startswith("data:"):
+            return url
+        digest = self._by_url.get(url)
+        cached = self._by_hash.get(digest) if digest is not None else None
+        if cached is not None:
+            return cached
+
+        data = await self.download(url)
+        digest = hashlib.sha256(data).hexdigest()
+        cached = self._by_hash.get(digest)
+        if cached is None:
+            mime = sniff_mime(data)
+            if mime is None:
+                raise ValueError("Unsupported image format")
+            if self.max_side > 0:
+                data, mime = await executor.run_cpu(shrink_image, data, mime, self.max_side, self.max_bytes)
+            cached = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+            self._by_hash.set(digest, cached)
+        self._by_url.set(url, digest)
+        return cached
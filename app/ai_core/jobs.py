@@ -0,0 +1,152 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from app.ai_core.executor import executor
+from app.ai_core.metrics import registry
+from app.ai_core.models import Job
+from app.config.settings import Settings
+
+
+class QueueFull(Exception):
+    """Raised by put when `max_depth` jobs are already waiting."""
+
+
+class JobQueue(ABC):
+    """Hands jobs from the gateway to the workers.
+
+    A job is claimed by one worker at a time and only removed once acked, so jobs of a worker
+    that died are handed out again after `visibility_timeout`. Jobs of the same user are claimed
+    one at a time and in order, which keeps per-user history consistent across workers.
+    """
+
+    @abstractmethod
+    async def put(self, job: Job):
+        """Enqueue a job, raising QueueFull when the queue is at capacity."""
+
+    @abstractmethod
+    async def get(self) -> Job:
+        """Wait for and claim the next job."""
+
+    @abstractmethod
+    async def ack(self, job: Job):
+        """Remove a finished job."""
+
+    @abstractmethod
+    async def depth(self) -> int:
+        """Number of jobs not yet claimed."""
+
+
+class SQLiteJobQueue(JobQueue):
+    """A JobQueue in an SQLite file, shared by the processes of one host.
+
+    Idle workers poll for jobs every `poll_interval`, doubling the interval up to `max_poll_interval`
+    while the queue stays empty. `waiting` is the depth as of this process's last put or claim, for
+    readers on the event loop that mustn't wait for the database.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_depth: int = 0,
+        visibility_timeout: float = 600,
+        poll_interval: float = 0.05,
+        max_poll_interval: float = 1.0,
+    ):
+        self.max_depth = max_depth
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.waiting = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT NOT NULL, payload TEXT NOT NULL, claimed_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user, claimed_at)")
+
+    def _put(self, job: Job):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.max_depth > 0 and self._depth() >= self.max_depth:
+                    raise QueueFull(f"{self.max_depth} jobs are already waiting")
+                self._conn.execute("INSERT INTO jobs (user, payload) VALUES (?, ?)", (job.user, job.model_dump_json()))
+                self.waiting = self._depth()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _claim(self) -> Job | None:
+        now = time.time()
+        stale = now - self.visibility_timeout
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, payload FROM jobs WHERE (claimed_at IS NULL OR claimed_at < ?) "
+                    "AND user NOT IN (SELECT user FROM jobs WHERE claimed_at >= ?) ORDER BY id LIMIT 1",
+                    (stale, stale),
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE jobs SET claimed_at = ? WHERE id = ?", (now, row[0]))
+                self.waiting = self._depth()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = Job.model_validate_json(row[1])
+        job.id = row[0]
+        return job
+
+    def _ack(self, id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (id,))
+
+    def _depth(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE claimed_at IS NULL").fetchone()[0]
+
+    def _fresh_depth(self) -> int:
+        with self._lock:
+            self.waiting = self._depth()
+            return self.waiting
+
+    async def put(self, job: Job):
+        await executor.run(self._put, job)
+
+    async def get(self) -> Job:
+        interval = self.poll_interval
+        while True:
+            job = await executor.run(self._claim)
+            if job is not None:
+                return job
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    async def ack(self, job: Job):
+        await executor.run(self._ack, job.id)
+
+    async def depth(self) -> int:
+        return await executor.run(self._fresh_depth)
+
+
+def job_queue_from_config(config: Settings) -> JobQueue | None:
+    url = config.job_queue_url
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        queue = SQLiteJobQueue(
+            url.removeprefix("sqlite:///"),
+            max_depth=config.job_queue_max_depth,
+            visibility_timeout=config.job_visibility_timeout,
+        )
+        registry.gauge("aiverse_job_queue_depth", "Jobs waiting for a worker.", [], lambda: {(): queue.waiting})
+        return queue
+    raise ValueError(f"Unsupported job queue: {url}")
@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from app.ai_core.tokens import TokenCounter, approximate_num_tokens
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Labels) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) or (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+        self.values: Dict[Labels, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            counts, total, n = self.values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, n + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        for key, (counts, total, n) in self.values.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (str(bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {n}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose values are read from `collect` at scrape time."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], collect: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.warning(f"collecting {self.name} failed: {e}")
+            return lines
+        lines += [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in values.items()]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = ()) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str], collect: Callable[[], Dict[Labels, float]]) -> Gauge:
+        self.metrics[name] = Gauge(name, help, labels, collect)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        return "\n".join(line for m in self.metrics.values() for line in m.render()) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "aiverse_stage_seconds", "Time spent in each stage of the message pipeline.", ["stage"]
+)
+errors_total = registry.counter("aiverse_errors_total", "Errors by stage and exception class.", ["stage", "error"])
+llm_tokens_total = registry.counter(
+    "aiverse_llm_tokens_total", "LLM tokens by provider, estimated when not reported.", ["provider", "kind"]
+)
+history_tokens = registry.histogram(
+    "aiverse_history_tokens",
+    "Tokens of history sent with each prompt.",
+    buckets=(0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+loop_lag_seconds = registry.histogram(
+    "aiverse_loop_lag_seconds",
+    "How late the event loop woke up from a short sleep.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record how long the block takes under `stage`, and the class of any exception it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        errors_total.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+
+def _run_name(serialized: Dict[str, Any] | None, default: str) -> str:
+    if not serialized:
+        return default
+    return serialized.get("name") or (serialized.get("id") or [default])[-1]
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times LLM and tool runs and counts tokens per provider."""
+
+    run_inline = True
+
+    def __init__(self, token_counter: TokenCounter | None = None):
+        self.token_counter = token_counter
+        self._runs: Dict[UUID, Tuple[str, float, int]] = {}
+        self._delegating: set[UUID] = set()  # runs, like the router's, whose tokens their child runs count
+
+    def _count(self, messages: List[BaseMessage]) -> int:
+        if self.token_counter:
+            return sum(self.token_counter(m) for m in messages)
+        return sum(approximate_num_tokens(str(m.content)) for m in messages)
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
+    ) -> Any:
+        provider = _run_name(serialized, "llm")
+        parent = kwargs.get("parent_run_id")
+        if parent in self._runs:
+            self._delegating.add(parent)
+        self._runs[run_id] = (provider, time.perf_counter(), sum(self._count(m) for m in messages))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        provider, started, prompt_tokens = self._runs.pop(run_id, ("llm", time.perf_counter(), 0))
+        stage_seconds.observe(time.perf_counter() - started, stage=f"llm.{provider}")
+        if run_id in self._delegating:
+            self._delegating.discard(run_id)
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            text = "".join(g.text for gs in response.generations for g in gs)
+            completion_tokens = approximate_num_tokens(text)
+        llm_tokens_total.inc(usage.get("prompt_tokens", prompt_tokens), provider=provider, kind="prompt")
+        llm_tokens_total.inc(completion_tokens, provider=provider, kind="completion")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        provider, started, _ = self._runs.pop(run_id, ("llm", time.perf_counter(), 0))
+        self._delegating.discard(run_id)
+        stage_seconds.observe(time.perf_counter() - started, stage=f"llm.{provider}")
+        if not isinstance(error, asyncio.CancelledError):  # e.g. the losing side of a hedged request
+            errors_total.inc(stage=f"llm.{provider}", error=type(error).__name__)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._runs[run_id] = (_run_name(serialized, "tool"), time.perf_counter(), 0)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
+        name, started, _ = self._runs.pop(run_id, ("tool", time.perf_counter(), 0))
+        stage_seconds.observe(time.perf_counter() - started, stage=f"tool.{name}")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        name, started, _ = self._runs.pop(run_id, ("tool", time.perf_counter(), 0))
+        stage_seconds.observe(time.perf_counter() - started, stage=f"tool.{name}")
+        errors_total.inc(stage=f"tool.{name}", error=type(error).__name__)
+
+
+class SampledTracingHandler(BaseCallbackHandler):
+    """Logs the chain, llm and tool spans of a `sample_rate` fraction of requests."""
+
+    run_inline = True
+
+    def __init__(self, sample_rate: float):
+        self.sample_rate = sample_rate
+        self._spans: Dict[UUID, Tuple[str, float, UUID | None]] = {}
+        self._sampled: set[UUID] = set()
+
+    def _start(self, name: str, run_id: UUID, parent_run_id: UUID | None):
+        if parent_run_id is None:
+            if random.random() >= self.sample_rate:
+                return
+            self._sampled.add(run_id)
+        elif parent_run_id not in self._sampled:
+            return
+        self._sampled.add(run_id)
+        self._spans[run_id] = (name, time.perf_counter(), parent_run_id)
+
+    def _end(self, run_id: UUID, error: BaseException | None = None):
+        self._sampled.discard(run_id)
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        name, started, parent = span
+        logger.info(
+            "span %s run=%s parent=%s %.3fs%s",
+            name,
+            run_id,
+            parent,
+            time.perf_counter() - started,
+            f" error={type(error).__name__}" if error else "",
+        )
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        self._start(_run_name(serialized, "chain"), run_id, parent_run_id)
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any) -> Any:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._end(run_id, error)
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        self._start(_run_name(serialized, "llm"), run_id, parent_run_id)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._end(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._end(run_id, error)
+
+    def on_tool_start(
+        self,
+        serialized: Dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        self._start(_run_name(serialized, "tool"), run_id, parent_run_id)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> Any:
+        self._end(run_id, error)
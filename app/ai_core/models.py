@@ -1 +1,16 @@
+from typing import List
 
+from pydantic import BaseModel
+
+
+class Job(BaseModel):
+    """A message the gateway received and a worker should answer."""
+
+    kind: str = "query"  # or "clear"
+    user: str
+    channel_id: int
+    message_id: int
+    content: str = ""
+    images: List[str] = []
+    context: str = ""  # recent channel messages to answer with
+    id: int | None = None  # assigned by the queue
@@ -0,0 +1,146 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, Dict, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from app.ai_core.cache import TTLCache
+from app.ai_core.executor import executor
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# a cached answer and how long it originally took to produce
+Entry = Tuple[str, float]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivially different prompts share an entry."""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip("?!.。？！~ ").lower()
+
+
+class SQLiteResponseStore:
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, latency REAL NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Entry | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, latency FROM responses WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: Entry):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, latency, expires) VALUES (?, ?, ?, ?)",
+                (key, value[0], value[1], time.time() + self.ttl),
+            )
+
+
+class ResponseCache:
+    """Reuses answers to repeated prompts, by exact normalized match and optionally by embedding similarity.
+
+    Entries are keyed on the normalized prompt plus a model id (model and temperature), and live
+    `ttl` seconds either in process or in an SQLite file. The similarity tier keeps the embeddings
+    of recent prompts in memory and returns the entry of the closest one above `similarity_threshold`.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        maxsize: int = 1024,
+        sqlite_path: str | None = None,
+        embeddings: Embeddings | None = None,
+        similarity_threshold: float = 0.95,
+    ):
+        self.ttl = ttl
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self._store: Any = SQLiteResponseStore(sqlite_path, ttl) if sqlite_path else TTLCache(maxsize, ttl)
+        self._vectors: Deque[Tuple[float, str, str, "np.ndarray"]] = deque(maxlen=maxsize)
+        self._embedded: TTLCache[str, "np.ndarray"] = TTLCache(maxsize=256, ttl=60)  # a miss is usually put next
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+        }
+
+    @staticmethod
+    def key(prompt: str, model_id: str) -> str:
+        return hashlib.sha256(f"{model_id}\0{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+    async def _get(self, key: str) -> Entry | None:
+        if isinstance(self._store, SQLiteResponseStore):
+            return await executor.run(self._store.get, key)
+        return self._store.get(key)
+
+    async def _set(self, key: str, value: Entry):
+        if isinstance(self._store, SQLiteResponseStore):
+            await executor.run(self._store.set, key, value)
+        else:
+            self._store.set(key, value)
+
+    async def aget(self, prompt: str, model_id: str) -> str | None:
+        entry = await self._get(self.key(prompt, model_id))
+        if entry is None and self.embeddings and self._vectors:
+            nearest = await self._nearest(prompt, model_id)
+            entry = await self._get(nearest) if nearest else None
+            if entry is not None:
+                self.semantic_hits += 1
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_seconds += entry[1]
+        return entry[0]
+
+    async def aput(self, prompt: str, model_id: str, response: str, latency: float):
+        key = self.key(prompt, model_id)
+        await self._set(key, (response, latency))
+        if self.embeddings:
+            vector = await self._embed(prompt)
+            self._vectors.append((time.monotonic() + self.ttl, model_id, key, vector))
+
+    async def _embed(self, prompt: str) -> "np.ndarray":
+        import numpy as np
+
+        text = normalize_prompt(prompt)
+        v = self._embedded.get(text)
+        if v is None:
+            v = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)  # type: ignore[union-attr]
+            v = v / (np.linalg.norm(v) or 1.0)
+            self._embedded.set(text, v)
+        return v
+
+    async def _nearest(self, prompt: str, model_id: str) -> str | None:
+        now = time.monotonic()
+        candidates = [(key, v) for expires, mid, key, v in self._vectors if mid == model_id and expires > now]
+        if not candidates:
+            return None
+        import numpy as np
+
+        scores = np.stack([v for _, v in candidates]) @ await self._embed(prompt)
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.similarity_threshold else None
@@ -0,0 +1,340 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import AsyncExitStack, nullcontext
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+from uuid import UUID, uuid4
+
+from langchain_core.callbacks import (
+    AsyncCallbackManager,
+    AsyncCallbackManagerForLLMRun,
+    BaseCallbackManager,
+    CallbackManager,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, BaseMessageChunk
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.runnables import RunnableConfig, ensure_config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# callbacks and run id of the router's stream starting in this context, see RouterChatModel.astream
+_stream_run: ContextVar[Tuple[Any, UUID] | None] = ContextVar("router_stream_run", default=None)
+
+_retryable_status = {408, 409, 429}
+_retryable_names = ("Timeout", "RateLimit", "Overloaded", "ServiceUnavailable", "InternalServer", "Connection")
+
+
+def is_retryable(e: BaseException) -> bool:
+    """Whether another provider may succeed where this one failed: timeouts, 429s and 5xx."""
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in _retryable_status or status >= 500
+    return any(n in type(e).__name__ for n in _retryable_names)
+
+
+def child_callbacks(
+    run_manager: CallbackManagerForLLMRun | AsyncCallbackManagerForLLMRun | None, cls: Type[BaseCallbackManager]
+) -> BaseCallbackManager | None:
+    """Callbacks for the provider calls, as children of the router's run; llm run managers have no get_child."""
+    if run_manager is None:
+        run = _stream_run.get()
+        if run is None:
+            return None
+        manager = cls.configure(run[0])  # type: ignore[attr-defined]
+        manager.parent_run_id = run[1]
+        return manager
+    manager = cls(handlers=[], parent_run_id=run_manager.run_id)
+    manager.set_handlers(run_manager.inheritable_handlers)
+    manager.add_tags(run_manager.inheritable_tags)
+    manager.add_metadata(run_manager.inheritable_metadata)
+    return manager
+
+
+class RouteStats:
+    """Rolling latency and error rate of one provider, plus its circuit breaker."""
+
+    def __init__(self, window: int = 50):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.errors: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def score(self) -> float:
+        # untried providers score 0 so they get probed; errors weigh as much as 10s of latency
+        return self.latency + 10 * self.error_rate
+
+    def record(self, latency: float, ok: bool, failure_threshold: int):
+        self.errors.append(not ok)
+        if ok:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def available(self, cooldown: float) -> bool:
+        # a tripped breaker lets a request through again (half-open) once the cooldown passed
+        return self.opened_at is None or time.monotonic() - self.opened_at >= cooldown
+
+
+class RouterChatModel(BaseChatModel):
+    """Chat model that sends each request to the healthiest of several providers.
+
+    Providers are ranked by rolling latency and error rate. Timeouts, rate limits and 5xx errors
+    fail over to the next provider within the same request; providers failing repeatedly are
+    skipped for `cooldown` seconds. With `hedge_after` set, a request that hasn't answered (or
+    streamed its first chunk) in time is also sent to the next provider and the first one wins.
+
+    The provider models run as children of the router's run, so callbacks see which provider
+    answered. `limiter`, when set, caps concurrent calls per provider once one was picked.
+    """
+
+    models: Dict[str, BaseChatModel]
+    timeout: float = 60
+    hedge_after: float = 0
+    failure_threshold: int = 3
+    cooldown: float = 30
+    limiter: Optional[Callable[[str], AsyncContextManager[Any]]] = None
+    _stats: Dict[str, RouteStats] = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "router"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"models": list(self.models)}
+
+    def stats(self, name: str) -> RouteStats:
+        if name not in self._stats:
+            self._stats[name] = RouteStats()
+        return self._stats[name]
+
+    def ranked(self) -> List[str]:
+        """Available providers from best to worst, then the tripped ones as a last resort."""
+        names = sorted(self.models, key=lambda n: self.stats(n).score())
+        return [n for n in names if self.stats(n).available(self.cooldown)] + [
+            n for n in names if not self.stats(n).available(self.cooldown)
+        ]
+
+    # this langchain passes no run manager to _stream and _astream, so the router names its streaming
+    # runs itself and hands their callbacks down through _stream_run
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[BaseMessageChunk]:
+        config = ensure_config(config)
+        run_id = config.get("run_id") or uuid4()
+        stream = super().stream(input, {**config, "run_id": run_id}, **kwargs)
+        token = _stream_run.set((config.get("callbacks"), run_id))
+        try:
+            first = next(stream, None)  # _stream picks the callbacks up before its first chunk
+        finally:
+            _stream_run.reset(token)
+        if first is None:
+            return
+        yield first
+        yield from stream
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[BaseMessageChunk]:
+        config = ensure_config(config)
+        run_id = config.get("run_id") or uuid4()
+        stream = super().astream(input, {**config, "run_id": run_id}, **kwargs)
+        token = _stream_run.set((config.get("callbacks"), run_id))
+        try:
+            first = await stream.__anext__()  # _astream picks the callbacks up before its first chunk
+        except StopAsyncIteration:
+            return
+        finally:
+            _stream_run.reset(token)
+        yield first
+        async for chunk in stream:
+            yield chunk
+
+    def _limit(self, name: str) -> AsyncContextManager[Any]:
+        return self.limiter(name) if self.limiter else nullcontext()
+
+    def _record(self, name: str, started: float, ok: bool):
+        self.stats(name).record(time.monotonic() - started, ok, self.failure_threshold)
+
+    async def _race(self, start: Callable[[str], Awaitable[T]]) -> Tuple[str, T]:
+        order = self.ranked()
+        pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+        error: BaseException | None = None
+
+        def launch():
+            name = order.pop(0)
+            pending[asyncio.create_task(asyncio.wait_for(start(name), self.timeout))] = (name, time.monotonic())
+
+        launch()
+        try:
+            while pending:
+                hedge = self.hedge_after > 0 and bool(order)
+                done, _ = await asyncio.wait(
+                    pending, timeout=self.hedge_after if hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    logger.info("hedging request to %s", order[0])
+                    launch()
+                    continue
+                for task in done:
+                    name, started = pending.pop(task)
+                    error = task.exception()
+                    self._record(name, started, error is None)
+                    if error is None:
+                        return name, task.result()
+                    if not is_retryable(error):
+                        raise error
+                    logger.warning("provider %s failed, failing over: %r", name, error)
+                if not pending and order:
+                    launch()
+            raise error  # type: ignore[misc]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        error: BaseException | None = None
+        for name in self.ranked():
+            started = time.monotonic()
+            try:
+                r = self.models[name].generate(
+                    [messages], stop=stop, callbacks=child_callbacks(run_manager, CallbackManager), **kwargs
+                )
+            except Exception as e:
+                self._record(name, started, False)
+                if not is_retryable(e):
+                    raise
+                error = e
+                continue
+            self._record(name, started, True)
+            return ChatResult(generations=r.generations[0], llm_output=r.llm_output)  # type: ignore[arg-type]
+        raise error  # type: ignore[misc]
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        callbacks = child_callbacks(run_manager, AsyncCallbackManager)
+
+        async def start(name: str):
+            async with self._limit(name):
+                return await self.models[name].agenerate([messages], stop=stop, callbacks=callbacks, **kwargs)
+
+        _, r = await self._race(start)
+        return ChatResult(generations=r.generations[0], llm_output=r.llm_output)  # type: ignore[arg-type]
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        error: BaseException | None = None
+        for name in self.ranked():
+            started = time.monotonic()
+            callbacks = child_callbacks(run_manager, CallbackManager)
+            it = self.models[name].stream(messages, config={"callbacks": callbacks}, stop=stop, **kwargs)
+            try:
+                first = next(it, None)
+            except Exception as e:
+                self._record(name, started, False)
+                if not is_retryable(e):
+                    raise
+                error = e
+                continue
+            self._record(name, started, True)
+            if first is None:
+                return
+            for chunk in itertools.chain([first], it):
+                gen = ChatGenerationChunk(message=chunk)  # type: ignore[arg-type]
+                if run_manager:
+                    run_manager.on_llm_new_token(gen.text, chunk=gen)
+                yield gen
+            return
+        raise error  # type: ignore[misc]
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        callbacks = child_callbacks(run_manager, AsyncCallbackManager)
+
+        async def start(name: str):
+            # the provider's slot is held until the stream ends
+            stack = AsyncExitStack()
+            try:
+                await stack.enter_async_context(self._limit(name))
+                it = self.models[name].astream(messages, config={"callbacks": callbacks}, stop=stop, **kwargs)
+                it = it.__aiter__()
+                try:
+                    return stack, it, await it.__anext__()
+                except StopAsyncIteration:
+                    return stack, it, None
+            except BaseException:
+                await stack.aclose()
+                raise
+
+        # failing over is only possible until the first chunk was handed out
+        _, (stack, it, first) = await self._race(start)
+        async with stack:
+            if first is None:
+                return
+            async for chunk in _prepend(first, it):
+                gen = ChatGenerationChunk(message=chunk)  # type: ignore[arg-type]
+                if run_manager:
+                    await run_manager.on_llm_new_token(gen.text, chunk=gen)
+                yield gen
+
+
+async def _prepend(first: T, it: AsyncIterator[T]) -> AsyncIterator[T]:
+    yield first
+    async for x in it:
+        yield x
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Dict
+
+
+class SchedulerBusy(Exception):
+    """Raised instead of queueing when too many requests are already waiting."""
+
+
+class RequestScheduler:
+    """Admission control in front of the LLM calls.
+
+    Requests of the same user run one at a time, so a user's history is never read and saved by
+    two requests at once. Since each user has at most one request competing for a slot, the FIFO
+    slot queue is also fair across users. In-flight calls are capped globally and per provider.
+    A user's request is rejected with SchedulerBusy once `max_user_queue` of theirs are already
+    running or waiting, and a user's first request once `max_queue_depth` users are waiting for a
+    slot, so one user's burst cannot crowd out the others.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 8,
+        max_queue_depth: int = 64,
+        provider_limits: Dict[str, int] = {},
+        max_user_queue: int = 3,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_user_queue = max_user_queue
+        self._global = asyncio.Semaphore(max_in_flight)
+        self._providers = {name: asyncio.Semaphore(n) for name, n in provider_limits.items()}
+        self._users: Dict[str, asyncio.Lock] = {}
+        self._user_refs: Dict[str, int] = {}
+        self.queued = 0
+        self.user_queued = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queued": self.queued,
+            "user_queued": self.user_queued,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait,
+        }
+
+    @asynccontextmanager
+    async def slot(self, user: str, provider: str = "") -> AsyncIterator[float]:
+        """Wait for a turn to call `provider` on behalf of `user`, yielding the time spent waiting."""
+        refs = self._user_refs.get(user, 0)
+        if self.max_user_queue > 0 and refs >= self.max_user_queue:
+            self.rejected += 1
+            raise SchedulerBusy(f"{refs} requests of {user} are already waiting")
+        if not refs and self.max_queue_depth > 0 and self.queued >= self.max_queue_depth:
+            self.rejected += 1
+            raise SchedulerBusy(f"{self.queued} requests are already waiting")
+
+        lock = self._users.setdefault(user, asyncio.Lock())
+        self._user_refs[user] = refs + 1
+        started = time.monotonic()
+        try:
+            async with AsyncExitStack() as stack:
+                self.user_queued += 1
+                try:
+                    await stack.enter_async_context(lock)
+                finally:
+                    self.user_queued -= 1
+                self.queued += 1  # only the user's head-of-line request competes for a slot
+                try:
+                    if provider in self._providers:
+                        await stack.enter_async_context(self._providers[provider])
+                    await stack.enter_async_context(self._global)
+                finally:
+                    self.queued -= 1
+
+                wait = time.monotonic() - started
+                self.admitted += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.in_flight += 1
+                try:
+                    yield wait
+                finally:
+                    self.in_flight -= 1
+        finally:
+            self._user_refs[user] -= 1
+            if not self._user_refs[user]:
+                del self._user_refs[user]
+                del self._users[user]
+
+    @asynccontextmanager
+    async def provider_slot(self, provider: str) -> AsyncIterator[None]:
+        """Hold one of the call slots of `provider`, for callers that only pick it late, like the router."""
+        if provider not in self._providers:
+            yield
+            return
+        async with self._providers[provider]:
+            yield
@@ -0,0 +1,69 @@
+from functools import lru_cache
+from typing import Any, Callable
+
+from langchain_core.messages import BaseMessage
+
+from app.config.settings import Settings
+
+TokenCounter = Callable[[BaseMessage], int]
+
+# per-message framing overhead, roughly what the chat completion formats add around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str) -> Any:
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def approximate_num_tokens(text: str) -> int:
+    """A cheap estimate: ~4 ascii characters per token, one token per non-ascii character."""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        p if isinstance(p, str) else p.get("text", "") for p in message.content if isinstance(p, (str, dict))
+    )
+
+
+def _message_counter(count_text: Callable[[str], int]) -> TokenCounter:
+    count_text = lru_cache(maxsize=4096)(count_text)
+
+    def count(message: BaseMessage) -> int:
+        return count_text(message_text(message)) + MESSAGE_OVERHEAD_TOKENS
+
+    return count
+
+
+def tiktoken_counter(model: str) -> TokenCounter:
+    encoding = _tiktoken_encoding(model)
+    return _message_counter(lambda text: len(encoding.encode(text)))
+
+
+def approximate_counter() -> TokenCounter:
+    return _message_counter(approximate_num_tokens)
+
+
+@lru_cache(maxsize=None)
+def _counter_for(provider: str, model: str) -> TokenCounter:
+    if provider in ("openai", "groq"):
+        return tiktoken_counter(model)
+    return approximate_counter()
+
+
+def token_counter_from_config(config: Settings) -> TokenCounter:
+    if config.is_openai:
+        return _counter_for("openai", config.openai_model_name)
+    if config.is_groq and not (config.is_mistral or config.is_google):
+        # groq serves open models, cl100k is close enough for budgeting
+        return _counter_for("groq", "cl100k_base")
+    return _counter_for("approximate", "")
@@ -1,15 +1,135 @@
-from typing import Optional
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
 
 import httpx
-from bs4 import BeautifulSoup
-from langchain.prompts import PromptTemplate
-from langchain.tools.openweathermap.tool import OpenWeatherMapQueryRun
-from langchain_community.utilities.dalle_image_generator import DallEAPIWrapper
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain_core.language_models.llms import BaseLanguageModel
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.pydantic_v1 import PrivateAttr
 from langchain_core.tools import BaseTool
 
+from app.ai_core.cache import TTLCache
+from app.ai_core.http_client import http_client
+from app.ai_core.image_jobs import ImageJobsBusy, image_deliveries, image_jobs
+
+# tool responses that are fine to reuse for a few minutes, keyed by tool name and input
+tool_cache: TTLCache[str, str] = TTLCache(maxsize=1024, ttl=300)
+
+# tool metadata marking answers that must not be served from the response cache
+time_sensitive = {"time_sensitive": True}
+
+# generating an image often takes 15-30s, well past the shared http client's timeout
+image_timeout = 120.0
+
+# the shared httpx client and the AsyncOpenAI client built on it
+_openai: Tuple[Any, Any] = (None, None)
+
+
+def openai_client() -> Any:
+    """An AsyncOpenAI client on the shared connection pool, rebuilt only when the pool is."""
+    global _openai
+    client = http_client.client
+    if _openai[0] is not client:
+        from openai import AsyncOpenAI
+
+        _openai = (client, AsyncOpenAI(http_client=client))
+    return _openai[1]
+
+
+# what the image tools answer when the image is delivered once it is ready
+image_placeholder = "The image is being generated and will be attached to this reply as soon as it is ready."
+
+
+async def generate_image(expand: Callable[[], Awaitable[str]], generate: Callable[[str], Awaitable[str]]) -> str:
+    """Run an image job, handing it to the front end when it delivers images itself."""
+    try:
+        job = image_jobs.submit(expand, generate)
+    except ImageJobsBusy:
+        return "Too many images are being generated right now, ask the user to try again in a minute."
+    deliveries = image_deliveries.get()
+    if deliveries is None:
+        return await job
+    deliveries.append(job)
+    return image_placeholder
+
+
+class LazyTool(BaseTool):
+    """Tool that stands in for another one and only builds it on first use."""
+
+    factory: Callable[[], BaseTool]
+    _tool: BaseTool | None = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def tool(self) -> BaseTool:
+        if self._tool is None:
+            with self._lock:
+                if self._tool is None:
+                    self._tool = self.factory()
+        return self._tool
+
+    def _run(self, *args: Any, run_manager: Optional[CallbackManagerForToolRun] = None, **kwargs: Any) -> Any:
+        return self.tool._run(*args, run_manager=run_manager, **kwargs)
+
+    async def _arun(
+        self, *args: Any, run_manager: Optional[AsyncCallbackManagerForToolRun] = None, **kwargs: Any
+    ) -> Any:
+        return await self.tool._arun(*args, run_manager=run_manager, **kwargs)
+
+
+def lazy_tool(tool_cls: Type[BaseTool], factory: Callable[[], BaseTool], **kwargs: Any) -> LazyTool:
+    """Describe a tool to the agent from its class defaults, deferring construction to `factory`."""
+    fields = tool_cls.__fields__
+    return LazyTool(
+        name=fields["name"].default,
+        description=fields["description"].default,
+        args_schema=fields["args_schema"].default,
+        return_direct=fields["return_direct"].default,
+        factory=factory,
+        **kwargs,
+    )
+
+
+class LimitedTool(BaseTool):
+    """Tool that runs another one under a shared cap on in-flight calls and a timeout.
+
+    A call that times out returns a message saying so, so the agent can answer with the other
+    tool results instead of failing the whole turn.
+    """
+
+    inner: Any  # the wrapped BaseTool; typed loosely so pydantic does not copy it
+    timeout: float = 30
+    limiter: Any  # asyncio.Semaphore shared by the tools of one agent
+
+    def _run(self, *args: Any, run_manager: Optional[CallbackManagerForToolRun] = None, **kwargs: Any) -> Any:
+        return self.inner._run(*args, run_manager=run_manager, **kwargs)
+
+    async def _arun(
+        self, *args: Any, run_manager: Optional[AsyncCallbackManagerForToolRun] = None, **kwargs: Any
+    ) -> Any:
+        async with self.limiter:
+            try:
+                return await asyncio.wait_for(
+                    self.inner._arun(*args, run_manager=run_manager, **kwargs), timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                return f"{self.name} did not answer within {self.timeout:g} seconds."
+
+
+def limited_tool(tool: BaseTool, timeout: float, limiter: asyncio.Semaphore) -> LimitedTool:
+    return LimitedTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        return_direct=tool.return_direct,
+        metadata=tool.metadata,
+        inner=tool,
+        timeout=timeout,
+        limiter=limiter,
+    )
+
 
 class DallEAPIWrapperRun(BaseTool):
     """Tool that uses DALL-E to draw a picture."""
@@ -26,9 +146,27 @@ class DallEAPIWrapperRun(BaseTool):
 
     def _run(self, input: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
         """Use DallEAPIWrapperRun tool."""
+        from langchain_community.utilities.dalle_image_generator import DallEAPIWrapper
+
         chain = self.prompt | self.client | StrOutputParser()
         return DallEAPIWrapper(model="dall-e-3").run(chain.invoke({"image_desc": input}))  # type: ignore[call-arg]
 
+    async def _arun(self, input: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        """Use DallEAPIWrapperRun tool asynchronously, as a background image job."""
+        return await generate_image(lambda: self._expand(input), self._generate)
+
+    async def _expand(self, input: str) -> str:
+        chain = self.prompt | self.client | StrOutputParser()
+        return (await chain.ainvoke({"image_desc": input})).strip()
+
+    async def _generate(self, image_prompt: str) -> str:
+        images = openai_client().images
+        async with http_client.limit():
+            r = await images.generate(
+                prompt=image_prompt, model="dall-e-3", n=1, size="1024x1024", timeout=image_timeout
+            )
+        return r.data[0].url or ""
+
 
 class AzureDallERun(BaseTool):
     """Tool that uses DALL-E to draw a picture."""
@@ -43,18 +181,16 @@ class AzureDallERun(BaseTool):
         """Use the DALLEQueryRun tool."""
         return self.client.invoke(input=input)
 
+    async def _arun(self, input: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        """Use the DALLEQueryRun tool asynchronously, as a background image job."""
 
-class OpenWeatherMapQueryRunEnhanced(OpenWeatherMapQueryRun):
-    description = (
-        "A wrapper around OpenWeatherMap API. "
-        "Useful for fetching current weather information for a specified location. "
-        "Input should be a location string (e.g. London,GB). If it's a Chinese place name, it needs to be converted into the corresponding English place name."
-        "**NOTE**: Make sure to confirm that the user is asking about the weather."
-    )
+        async def expand() -> str:
+            return input.strip()
+
+        async def generate(prompt: str) -> str:
+            return str(await self.client.ainvoke(input=prompt))
 
-    def _run(self, location: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
-        """Use the OpenWeatherMap tool."""
-        return self.api_wrapper.run(location)
+        return await generate_image(expand, generate)
 
 
 class TwitterTranslatorRun(BaseTool):
@@ -65,24 +201,24 @@ class TwitterTranslatorRun(BaseTool):
         "Useful for when you need to get a tweet content with a url and translate it to authentic Simplified Chinese. Input must be a tweet url starts with `https://fxtwitter|twitter|x.com/`."
     )
 
-    def _run(self, url: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
-        """Use the TwitterTranslatorRun tool."""
+    @staticmethod
+    def _fxtwitter_url(url: str) -> str | None:
         if (
             not url.startswith("https://fxtwitter.com/")
             and not url.startswith("https://x.com/")
             and not url.startswith("https://twitter.com/")
         ):
-            return "Invalid twitter url."
+            return None
 
-        url = url.replace("https://twitter.com/", "https://fxtwitter.com/").replace(
+        return url.replace("https://twitter.com/", "https://fxtwitter.com/").replace(
             "https://x.com/", "https://fxtwitter.com/"
         )
 
-        r = httpx.get(url=url)
-        if r.status_code != 200:
-            return f"Error: {r.status_code}, {r.text}"
+    @staticmethod
+    def _parse(html: str) -> str:
+        from bs4 import BeautifulSoup
 
-        soup = BeautifulSoup(r.text, features="html.parser")
+        soup = BeautifulSoup(html, features="html.parser")
         title = soup.find("meta", property="og:title")
         desc = soup.find("meta", property="og:description")
         text = ""
@@ -92,3 +228,37 @@ class TwitterTranslatorRun(BaseTool):
             text += desc.get("content", "") + "\n"  # type: ignore[operator,union-attr]
 
         return text
+
+    def _run(self, url: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Use the TwitterTranslatorRun tool."""
+        fx_url = self._fxtwitter_url(url)
+        if fx_url is None:
+            return "Invalid twitter url."
+        text = tool_cache.get(fx_url)
+        if text is not None:
+            return text
+
+        r = httpx.get(url=fx_url)
+        if r.status_code != 200:
+            return f"Error: {r.status_code}, {r.text}"
+
+        text = self._parse(r.text)
+        tool_cache.set(fx_url, text)
+        return text
+
+    async def _arun(self, url: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        """Use the TwitterTranslatorRun tool asynchronously."""
+        fx_url = self._fxtwitter_url(url)
+        if fx_url is None:
+            return "Invalid twitter url."
+        text = tool_cache.get(fx_url)
+        if text is not None:
+            return text
+
+        r = await http_client.get(fx_url)
+        if r.status_code != 200:
+            return f"Error: {r.status_code}, {r.text}"
+
+        text = self._parse(r.text)
+        tool_cache.set(fx_url, text)
+        return text
@@ -0,0 +1,65 @@
+from typing import Optional
+
+from langchain.tools.openweathermap.tool import OpenWeatherMapQueryRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+
+from app.ai_core.http_client import http_client
+from app.ai_core.tools import tool_cache
+
+
+class OpenWeatherMapQueryRunEnhanced(OpenWeatherMapQueryRun):
+    description = (
+        "A wrapper around OpenWeatherMap API. "
+        "Useful for fetching current weather information for a specified location. "
+        "Input should be a location string (e.g. London,GB). If it's a Chinese place name, it needs to be converted into the corresponding English place name."
+        "**NOTE**: Make sure to confirm that the user is asking about the weather."
+    )
+
+    _endpoint = "https://api.openweathermap.org/data/2.5/weather"
+
+    def _run(self, location: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Use the OpenWeatherMap tool."""
+        key = f"weather:{location.strip().lower()}"
+        text = tool_cache.get(key)
+        if text is None:
+            text = self.api_wrapper.run(location)
+            tool_cache.set(key, text)
+        return text
+
+    async def _arun(self, location: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        """Use the OpenWeatherMap tool asynchronously, calling the REST API directly."""
+        key = f"weather:{location.strip().lower()}"
+        text = tool_cache.get(key)
+        if text is not None:
+            return text
+
+        params = {"q": location, "appid": self.api_wrapper.openweathermap_api_key, "units": "metric"}
+        r = await http_client.get(self._endpoint, params=params)
+        if r.status_code != 200:
+            return f"Error: {r.status_code}, {r.text}"
+
+        text = self._format_weather(location, r.json())
+        tool_cache.set(key, text)
+        return text
+
+    @staticmethod
+    def _format_weather(location: str, w: dict) -> str:
+        """Render a current weather response the same way OpenWeatherMapAPIWrapper does."""
+        main = w.get("main", {})
+        wind = w.get("wind", {})
+        rain = w.get("rain", {})
+        detailed_status = ", ".join(x.get("description", "") for x in w.get("weather", []))
+        return (
+            f"In {location}, the current weather is as follows:\n"
+            f"Detailed status: {detailed_status}\n"
+            f"Wind speed: {wind.get('speed')} m/s, direction: {wind.get('deg')}°\n"
+            f"Humidity: {main.get('humidity')}%\n"
+            f"Temperature: \n"
+            f"  - Current: {main.get('temp')}°C\n"
+            f"  - High: {main.get('temp_max')}°C\n"
+            f"  - Low: {main.get('temp_min')}°C\n"
+            f"  - Feels like: {main.get('feels_like')}°C\n"
+            f"Rain: {rain}\n"
+            f"Heat index: None\n"
+            f"Cloud cover: {w.get('clouds', {}).get('all')}%"
+        )
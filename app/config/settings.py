@@ -7,6 +7,12 @@ class Settings(BaseSettings):
     temperature: float = 0.7
     max_retries: int = 0
 
+    enable_router: bool = False
+    router_timeout: float = 60
+    router_hedge_after: float = 0
+    router_failure_threshold: int = 3
+    router_cooldown: float = 30
+
     google_api_key: str | None = None
     google_api_model: str = "gemini-1.5-pro-latest"
 
@@ -20,10 +26,81 @@ class Settings(BaseSettings):
     mistral_model: str = "mistral-small"
 
     history_max_size: int = 2000
+    history_mode: str = "buffer"  # or "summary"
+    history_summary_model: str | None = None
+    history_summary_max_tokens: int = 300
+    history_max_users: int = 1000
+    history_ttl: float = 3600
+    history_max_bytes: int = 0
+    history_sqlite_path: str | None = None
+
+    enable_response_cache: bool = False
+    response_cache_ttl: float = 3600
+    response_cache_max_entries: int = 1024
+    response_cache_min_length: int = 8
+    response_cache_sqlite_path: str | None = None
+    response_cache_semantic: bool = False
+    response_cache_similarity_threshold: float = 0.95
+
+    scheduler_max_in_flight: int = 8
+    scheduler_max_queue_depth: int = 64
+    scheduler_provider_limits: dict[str, int] = {}
+    scheduler_max_user_queue: int = 3
+
+    agent_mode: str = "functions"  # or "tools" for parallel tool calls
+    agent_tool_timeout: float = 30
+    agent_tool_timeouts: dict[str, float] = {}
+    agent_max_tool_calls: int = 4
+
+    job_queue_url: str = ""  # e.g. sqlite:///jobs.db
+    job_queue_max_depth: int = 256
+    job_visibility_timeout: float = 600
+    bot_workers: int = 0
 
     discord_bot_token: str = ""
+    stream_replies: bool = True
+    stream_edit_interval: float = 1.0
+    stream_overflow: str = "message"  # or "attachment" or "paste"
+    paste_endpoint: str = "https://paste.mozilla.org/api/"
+    paste_max_connections: int = 10
+    paste_timeout: float = 10
+    paste_retries: int = 3
     telegram_bot_token: str = ""
     telegram_allowed_users: list[str] = []
+    telegram_webhook_url: str = ""
+    telegram_webhook_listen: str = "0.0.0.0"
+    telegram_webhook_port: int = 8443
+    telegram_webhook_path: str = "telegram"
+    telegram_webhook_secret: str = ""
+
+    http_max_connections: int = 100
+    http_max_concurrency: int = 20
+    http_timeout: float = 10
+    tool_cache_ttl: float = 300
+
+    dalle_background: bool = True
+    image_job_workers: int = 2
+    image_job_max_queue: int = 16
+    image_job_cache_ttl: float = 600
+
+    message_cache_size: int = 5000
+    channel_context_messages: int = 0
+    executor_threads: int = 8
+    cpu_executor: str = "thread"  # or "process"
+    cpu_executor_workers: int = 2
+    loop_lag_threshold: float = 0.1
+
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 0
+    trace_sample_rate: float = 0
+
+    image_max_download_bytes: int = 20 * 1024 * 1024
+    image_max_side: int = 1568
+    image_max_bytes: int = 5 * 1024 * 1024
+    image_cache_ttl: float = 600
+    image_cache_bytes: int = 32 * 1024 * 1024
+    vision_multi_image: bool = True
+    vision_max_concurrency: int = 4
 
     openweathermap_api_key: str | None = None
 
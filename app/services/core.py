@@ -0,0 +1,49 @@
+"""What the front ends of one process share: the settings, the agent and the background tasks."""
+
+import asyncio
+import logging
+from typing import Coroutine, List, Set
+
+from app.ai_core.agents import LLMAgentExecutor
+from app.ai_core.executor import executor, monitor_loop_lag
+from app.ai_core.http_client import http_client
+from app.config.settings import Settings
+from app.services.http_api import paste_service_from_config
+from app.services.metrics_server import serve_metrics
+
+logger = logging.getLogger(__name__)
+config = Settings()
+llmAgent = LLMAgentExecutor(config=config)
+paste_service = paste_service_from_config(config)
+background: List[asyncio.Task] = []
+tasks: Set[asyncio.Task] = set()
+started = False
+
+
+def spawn(coro: Coroutine) -> asyncio.Task:
+    """Run `coro` in the background, keeping a reference until it is done."""
+    task = asyncio.create_task(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+
+async def start_background(warm_up: bool = True):
+    """Install the executor, start the loop monitor and metrics server and warm up the agent, once."""
+    global started
+    if started:
+        return
+    started = True
+    executor.install()
+    if config.loop_lag_threshold > 0:
+        background.append(asyncio.create_task(monitor_loop_lag(config.loop_lag_threshold)))
+    if config.metrics_port:
+        await serve_metrics(config.metrics_host, config.metrics_port)
+    if warm_up:
+        await llmAgent.warm_up()
+
+
+async def shutdown():
+    """Close the shared connection pools."""
+    await paste_service.aclose()
+    await http_client.aclose()
@@ -1,24 +1,106 @@
+import asyncio
 import logging
 import re
 from io import BytesIO
+from typing import Any, AsyncIterator, List, Optional, Tuple
 
 import nextcord
 from nextcord.ext import commands
 
-from app.ai_core.agents import LLMAgentExecutor
-from app.config.settings import Settings
-from app.services.http_api import PasteService
+from app.ai_core.image_jobs import image_deliveries
+from app.ai_core.jobs import QueueFull, job_queue_from_config
+from app.ai_core.metrics import stage_seconds, timed
+from app.ai_core.models import Job
+from app.ai_core.scheduler import SchedulerBusy
+from app.services.core import config, llmAgent, paste_service, shutdown, spawn, start_background
+from app.services.message_cache import CachedMessage, message_cache
+from app.services.streaming import ProgressiveReply
 
 logger = logging.getLogger(__name__)
-config = Settings()
-llmAgent = LLMAgentExecutor(config=config)
-paste_service = PasteService()
+job_queue = job_queue_from_config(config)  # when set, workers answer and this process only enqueues
+message_cache.maxsize = config.message_cache_size
+message_cache.per_channel = max(50, config.channel_context_messages)
 
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    async def close(self):
+        await shutdown()
+        await super().close()
+
+
+def markdown_file(text: str) -> nextcord.File:
+    return nextcord.File(fp=BytesIO(bytes(text, encoding="utf-8")), filename="message.md")
+
+
+class DiscordReply(ProgressiveReply):
+    def __init__(self, message: nextcord.Message, **kwargs):
+        super().__init__(**kwargs)
+        self.message = message
+
+    async def send(self, text: str) -> nextcord.Message:
+        with timed("discord.send"):
+            return await self.message.channel.send(text, reference=self.message)
+
+    async def edit(self, handle: Any, text: str):
+        with timed("discord.edit"):
+            await handle.edit(content=text)
+
+    async def attach(self, text: str):
+        with timed("discord.send"):
+            await self.message.channel.send(reference=self.message, file=markdown_file(text))
+
+    async def upload(self, text: str) -> str | None:
+        return await paste_service.create_paste(text)
+
+
+async def reply(message: nextcord.Message, response: AsyncIterator[str]) -> Tuple[str, Optional[nextcord.Message]]:
+    """Send the response, returning its text and the last message sent."""
+    if config.stream_replies:
+        r = DiscordReply(message, edit_interval=config.stream_edit_interval, overflow=config.stream_overflow)
+        return await r.consume(response), r.last_message
+
+    chunks = "".join([r async for r in response])
+    if len(chunks) > 2000 and config.stream_overflow == "paste":
+        with timed("discord.send"):
+            preview, url = await asyncio.gather(
+                message.channel.send(chunks[:2000], reference=message), paste_service.create_paste(chunks)
+            )
+        with timed("discord.edit"):
+            if url:
+                link = f"\n… {url}"
+                await preview.edit(content=chunks[: 2000 - len(link)] + link)
+            else:
+                await preview.edit(file=markdown_file(chunks))
+        return chunks, preview
+    with timed("discord.send"):
+        if len(chunks) > 2000:
+            sent = await message.channel.send(chunks[:2000], reference=message, file=markdown_file(chunks))
+            return chunks, sent
+        sent = await message.channel.send(chunks, reference=message)
+    return chunks, sent
+
+
+async def deliver_images(message: nextcord.Message, sent: Optional[nextcord.Message], jobs: List[asyncio.Task]):
+    """Add the images of background jobs to the reply as they finish."""
+    embeds: List[nextcord.Embed] = []
+    for job in asyncio.as_completed(jobs):
+        try:
+            url = await job
+        except Exception as e:
+            await message.channel.send(f"🤖 The image could not be generated: {e}", reference=message)
+            continue
+        embeds.append(nextcord.Embed().set_image(url=url))
+        try:
+            if sent is None:
+                raise ValueError("nothing to edit")
+            await sent.edit(embeds=embeds)
+        except (nextcord.HTTPException, ValueError):
+            sent = await message.channel.send(embed=embeds[-1], reference=message)
+            embeds = [embeds[-1]]
+
 
 intents = nextcord.Intents.default()
 intents.message_content = True
@@ -28,10 +110,32 @@ bot = Bot(intents=intents)
 @bot.event
 async def on_ready():
     logger.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
+    await start_background(warm_up=job_queue is None)
+
+
+def remember(message: nextcord.Message) -> CachedMessage:
+    cached = CachedMessage(message.id, message.channel.id, message.author.display_name, message.content)
+    if config.message_cache_size > 0:
+        message_cache.add(cached)
+    return cached
+
+
+@bot.event
+async def on_raw_message_edit(payload: nextcord.RawMessageUpdateEvent):
+    if "content" in payload.data:
+        message_cache.edit(payload.message_id, payload.data["content"])
+
+
+@bot.event
+async def on_raw_message_delete(payload: nextcord.RawMessageDeleteEvent):
+    message_cache.remove(payload.message_id)
 
 
 @bot.event
 async def on_message(message: nextcord.Message):
+    remember(message)
+    if message.reference and isinstance(message.reference.resolved, nextcord.Message):
+        remember(message.reference.resolved)
     if message.author == bot.user or message.mention_everyone:  # ignore this bot and disable @everyone
         return
 
@@ -40,47 +144,108 @@ async def on_message(message: nextcord.Message):
     if bot.user.mentioned_in(message) or isinstance(message.channel, nextcord.DMChannel) or role_mentioned:  # type: ignore[union-attr]
         raw_content = re.compile(r"<[^>]+>").sub("", message.content).lstrip()
         user_id = f"discord-{message.author.id}"
-        async with message.channel.typing():
-            try:
-                if message.attachments:
-                    for attachment in message.attachments:
-                        if any(
-                            attachment.filename.lower().endswith(ext)
-                            for ext in [".png", ".jpg", ".jpeg", ".gif", ".webp"]
-                        ):
-                            await message.add_reaction("🎨")
-                            cont = []
-                            if raw_content:
-                                cont.append({"type": "text", "text": raw_content})
-                            cont.append({"type": "image_url", "image_url": attachment.url})
-                            response = llmAgent.query(user_id, cont)  # type: ignore[arg-type]
-                            chunks = "".join([r async for r in response])
-                else:
-                    if "$clear" == raw_content:
-                        llmAgent.clear_history(str(message.author.id))
-                        await message.channel.send("🤖 Chat history has been reset.", reference=message)
-                        return
-                    await message.add_reaction("💬")
-
-                    if (not raw_content) and message.reference and message.reference.message_id:
-                        origin = await message.channel.fetch_message(message.reference.message_id)
-                        if origin and origin.content:
-                            raw_content = origin.content
-
-                    response = llmAgent.query(user_id, raw_content)
-                    chunks = "".join([r async for r in response])
-                llmAgent.save_history(user_id, raw_content, chunks)
-                if len(chunks) > 2000:
-                    await message.channel.send(
-                        chunks[:2000],
-                        reference=message,
-                        file=nextcord.File(fp=BytesIO(bytes(chunks, encoding="utf-8")), filename="message.md"),
-                    )
-                    return
-                await message.channel.send(chunks, reference=message)
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                await message.channel.send(f"🤖 {e}", reference=message)
+        if job_queue is not None:
+            return await enqueue(message, user_id, raw_content)
+        if "$clear" == raw_content and not message.attachments:
+            await llmAgent.clear_history(user_id)
+            await message.channel.send("🤖 Chat history has been reset.", reference=message)
+            return
+        try:
+            with timed("discord.on_message"):
+                async with llmAgent.scheduler.slot(user_id, llmAgent.provider) as wait:
+                    stage_seconds.observe(wait, stage="scheduler.wait")
+                    if wait > 1:
+                        logger.info("queued %s for %.2fs, scheduler %s", user_id, wait, llmAgent.scheduler.stats())
+                    async with message.channel.typing():
+                        await answer(message, user_id, raw_content)
+        except SchedulerBusy:
+            await message.channel.send("🤖 I'm busy right now, please try again in a moment.", reference=message)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            await message.channel.send(f"🤖 {e}", reference=message)
+
+
+async def enqueue(message: nextcord.Message, user_id: str, raw_content: str):
+    assert job_queue is not None
+    try:
+        if "$clear" == raw_content and not message.attachments:
+            job = Job(kind="clear", user=user_id, channel_id=message.channel.id, message_id=message.id)
+        else:
+            raw_content, images = await prepare(message, raw_content)
+            job = Job(
+                user=user_id,
+                channel_id=message.channel.id,
+                message_id=message.id,
+                content=raw_content,
+                images=images,
+                context=channel_context(message),
+            )
+        with timed("discord.enqueue"):
+            await job_queue.put(job)
+    except QueueFull:
+        await message.channel.send("🤖 I'm busy right now, please try again in a moment.", reference=message)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        await message.channel.send(f"🤖 {e}", reference=message)
+
+
+async def prepare(message: nextcord.Message, raw_content: str) -> Tuple[str, List[str]]:
+    """React to the message and resolve what to ask: the text (or the replied-to text) and image urls."""
+    images = [
+        a.url
+        for a in message.attachments
+        if any(a.filename.lower().endswith(ext) for ext in [".png", ".jpg", ".jpeg", ".gif", ".webp"])
+    ]
+    if images:
+        await message.add_reaction("🎨")
+        return raw_content, images
+
+    await message.add_reaction("💬")
+    if (not raw_content) and message.reference and message.reference.message_id:
+        origin = message_cache.get(message.reference.message_id)
+        if origin is None:
+            with timed("discord.fetch_message"):
+                origin = remember(await message.channel.fetch_message(message.reference.message_id))
+        if origin.content:
+            raw_content = origin.content
+    return raw_content, images
+
+
+def channel_context(message: nextcord.Message) -> str:
+    """The last cached messages of the channel before `message`, one per line."""
+    recent = message_cache.recent(message.channel.id, config.channel_context_messages, before=message.id)
+    return "\n".join(f"{m.author}: {m.content[:500]}" for m in recent if m.content)
+
+
+async def respond(
+    message: nextcord.Message | nextcord.PartialMessage,
+    user_id: str,
+    content: str,
+    images: List[str],
+    context: str = "",
+):
+    if images:
+        response = llmAgent.query_images(user_id, content, images)
+    else:
+        response = llmAgent.query(user_id, content, context)
+    jobs: List[asyncio.Task] = []
+    token = image_deliveries.set(jobs if config.dalle_background else None)
+    try:
+        chunks, sent = await reply(message, response)  # type: ignore[arg-type]
+    finally:
+        image_deliveries.reset(token)
+    if jobs:
+        spawn(deliver_images(message, sent, jobs))  # type: ignore[arg-type]
+    await llmAgent.save_history(user_id, content, chunks)
+
+
+async def answer(message: nextcord.Message, user_id: str, raw_content: str):
+    content, images = await prepare(message, raw_content)
+    await respond(message, user_id, content, images, channel_context(message))
+
+
+async def serve():
+    await bot.start(config.discord_bot_token)
 
 
 def start():
@@ -1,17 +1,79 @@
+import asyncio
+import logging
+
 import aiohttp
 
+from app.ai_core.metrics import timed
+from app.config.settings import Settings
+
+logger = logging.getLogger(__name__)
+
 
 class PasteService:
-    _conn = aiohttp.TCPConnector()
-    session = aiohttp.ClientSession(connector=_conn, timeout=aiohttp.ClientTimeout(total=10))
-    _endpoint = "https://paste.mozilla.org/api/"
+    """Uploads long replies to a dpaste-compatible pastebin and returns their url.
+
+    The aiohttp session is created lazily on the running loop with a bounded connection pool,
+    and transient failures (connection errors, timeouts, 429 and 5xx) are retried with
+    exponential backoff.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = "https://paste.mozilla.org/api/",
+        max_connections: int = 10,
+        timeout: float = 10,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.endpoint = endpoint
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._session: aiohttp.ClientSession | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
 
-    async def create_paste(self, data: str) -> str:
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._loop = loop
+        return self._session
+
+    async def create_paste(self, data: str) -> str | None:
+        """Upload `data` and return its url, or None when the upload failed."""
         payload = {"format": "url", "content": data, "expires": "604800", "lexer": "_markdown"}
-        try:
-            async with self.session.post(self._endpoint, data=payload) as resp:
-                if resp.status != 200:
-                    return f"Error: {resp.status}, {await resp.text()}"
-                return await resp.text()
-        except Exception as e:
-            return str(e)
+        error = ""
+        with timed("paste.upload"):
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+                try:
+                    async with self.session.post(self.endpoint, data=payload) as resp:
+                        if resp.status in (200, 201):
+                            return (await resp.text()).strip()
+                        error = f"{resp.status}, {await resp.text()}"
+                        if resp.status < 500 and resp.status != 429:
+                            break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = str(e) or type(e).__name__
+        logger.warning(f"Paste upload failed: {error}")
+        return None
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def paste_service_from_config(config: Settings) -> PasteService:
+    return PasteService(
+        endpoint=config.paste_endpoint,
+        max_connections=config.paste_max_connections,
+        timeout=config.paste_timeout,
+        retries=config.paste_retries,
+    )
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, NamedTuple
+
+from app.ai_core.metrics import registry
+
+
+class CachedMessage(NamedTuple):
+    id: int
+    channel_id: int
+    author: str
+    content: str
+
+
+class MessageCache:
+    """The most recent messages seen on the gateway, by id and per channel.
+
+    At most `maxsize` messages are kept in total and `per_channel` in each channel; the oldest
+    are evicted first. Filled from events the bot receives anyway, so lookups cost no api calls.
+    """
+
+    def __init__(self, maxsize: int = 5000, per_channel: int = 50):
+        self.maxsize = maxsize
+        self.per_channel = per_channel
+        self.hits = 0
+        self.misses = 0
+        self._messages: OrderedDict[int, CachedMessage] = OrderedDict()
+        self._channels: Dict[int, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, message: CachedMessage):
+        with self._lock:
+            if message.id in self._messages:
+                self._messages[message.id] = message
+                return
+            self._messages[message.id] = message
+            ids = self._channels.setdefault(message.channel_id, deque())
+            ids.append(message.id)
+            while len(ids) > self.per_channel:
+                self._messages.pop(ids.popleft(), None)
+            while len(self._messages) > self.maxsize:
+                self._evict()
+
+    def edit(self, id: int, content: str):
+        """Update the content of a cached message, ignoring messages that aren't cached."""
+        with self._lock:
+            message = self._messages.get(id)
+            if message is not None:
+                self._messages[id] = message._replace(content=content)
+
+    def remove(self, id: int):
+        with self._lock:
+            message = self._messages.pop(id, None)
+            if message is not None:
+                ids = self._channels[message.channel_id]
+                ids.remove(id)
+                if not ids:
+                    del self._channels[message.channel_id]
+
+    def get(self, id: int) -> CachedMessage | None:
+        with self._lock:
+            message = self._messages.get(id)
+            if message is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return message
+
+    def recent(self, channel_id: int, limit: int, before: int | None = None) -> List[CachedMessage]:
+        """The last `limit` cached messages of a channel, oldest first, optionally only those before `before`."""
+        with self._lock:
+            ids = [i for i in self._channels.get(channel_id, ()) if before is None or i < before]
+            return [self._messages[i] for i in ids[-limit:]] if limit > 0 else []
+
+    def _evict(self):
+        id, message = self._messages.popitem(last=False)
+        ids = self._channels[message.channel_id]
+        if id in ids:
+            ids.remove(id)
+        if not ids:
+            del self._channels[message.channel_id]
+
+
+message_cache = MessageCache()
+
+registry.gauge(
+    "aiverse_message_cache",
+    "Gateway messages kept for reply lookups and channel context.",
+    ["stat"],
+    lambda: {("size",): len(message_cache), ("hits",): message_cache.hits, ("misses",): message_cache.misses},
+)
@@ -0,0 +1,22 @@
+import logging
+
+from aiohttp import web
+
+from app.ai_core.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def serve_metrics(host: str, port: int) -> web.AppRunner:
+    """Serve the metrics registry at http://host:port/metrics on the running loop."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
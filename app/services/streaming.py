@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressiveReply(ABC):
+    """Renders a streamed reply by sending a message and editing it as chunks arrive.
+
+    Edits are rate limited to one per `edit_interval` seconds (or earlier once `batch_size`
+    characters are pending), and text past `max_length` rolls over into follow-up messages, or
+    into a single attachment when `overflow` is "attachment". With "paste" the message is cut
+    short and ends with a link to the full text, uploaded while the last preview edit is sent.
+    """
+
+    max_length = 2000
+
+    def __init__(self, edit_interval: float = 1.0, batch_size: int = 500, overflow: str = "message"):
+        self.edit_interval = edit_interval
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.started = time.monotonic()
+        self.first_token_at: float | None = None
+        self.text = ""
+        self._messages: List[Any] = []
+        self._offset = 0  # start of the text shown in the latest message
+        self._rendered = 0  # end of the text already sent to the latest message
+        self._last_flush = 0.0
+
+    @abstractmethod
+    async def send(self, text: str) -> Any:
+        """Send a new message and return a handle to it."""
+
+    @abstractmethod
+    async def edit(self, handle: Any, text: str):
+        """Replace the content of a sent message."""
+
+    @abstractmethod
+    async def attach(self, text: str):
+        """Send the whole text as an attachment."""
+
+    async def upload(self, text: str) -> str | None:
+        """Upload the whole text and return its url, None if that is not possible."""
+        return None
+
+    @property
+    def ttft(self) -> float | None:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+    @property
+    def last_message(self) -> Any:
+        return self._messages[-1] if self._messages else None
+
+    @property
+    def truncated(self) -> bool:
+        return self.overflow in ("attachment", "paste") and len(self.text) > self.max_length
+
+    async def append(self, chunk: str):
+        if not chunk:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.text += chunk
+        if not self._messages and not self.text.strip():  # can't send a blank message
+            return
+        if self.truncated:
+            return await self._flush()
+        pending = len(self.text) - self._rendered
+        if not self._messages or time.monotonic() - self._last_flush >= self.edit_interval or pending >= self.batch_size:
+            await self._flush()
+
+    async def consume(self, chunks: AsyncIterator[str]) -> str:
+        async for c in chunks:
+            await self.append(c)
+        return await self.finish()
+
+    async def finish(self) -> str:
+        if self.truncated and self.overflow == "paste":
+            _, url = await asyncio.gather(self._flush(), self.upload(self.text))
+            if url:
+                link = f"\n… {url}"
+                await self.edit(self._messages[-1], self.text[: self.max_length - len(link)] + link)
+            else:
+                await self.attach(self.text)
+        else:
+            await self._flush()
+            if self.truncated:
+                await self.attach(self.text)
+        logger.info(
+            "reply streamed, ttft=%.3fs total=%.3fs chars=%d messages=%d",
+            self.ttft or 0.0,
+            time.monotonic() - self.started,
+            len(self.text),
+            len(self._messages),
+        )
+        return self.text
+
+    async def _flush(self):
+        end = min(len(self.text), self.max_length) if self.overflow != "message" else len(self.text)
+        while self._rendered < end:
+            if not self._messages or self._rendered - self._offset >= self.max_length:
+                stop = min(end, self._rendered + self.max_length)
+                if not self.text[self._rendered : stop].strip():  # wait for something worth a new message
+                    break
+                self._offset = self._rendered
+                self._messages.append(await self.send(self.text[self._offset : stop]))
+            else:
+                stop = min(end, self._offset + self.max_length)
+                await self.edit(self._messages[-1], self.text[self._offset : stop])
+            self._rendered = stop
+        self._last_flush = time.monotonic()
@@ -0,0 +1,200 @@
+import asyncio
+import base64
+import logging
+from io import BytesIO
+from typing import Any, AsyncIterator, Dict, List
+
+from telegram import Message, Update
+from telegram.constants import ChatAction, ChatType, MessageLimit
+from telegram.error import BadRequest
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
+
+from app.ai_core.image_jobs import image_deliveries
+from app.ai_core.images import sniff_mime
+from app.ai_core.metrics import stage_seconds, timed
+from app.ai_core.scheduler import SchedulerBusy
+from app.services.core import config, llmAgent, paste_service, shutdown, spawn, start_background
+from app.services.streaming import ProgressiveReply
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramReply(ProgressiveReply):
+    max_length = MessageLimit.MAX_TEXT_LENGTH
+
+    def __init__(self, message: Message, **kwargs):
+        super().__init__(**kwargs)
+        self.message = message
+        self._shown: Dict[int, str] = {}  # message id to its text as telegram stores it, stripped
+
+    async def send(self, text: str) -> Message:
+        with timed("telegram.send"):
+            sent = await self.message.reply_text(text)
+        self._shown[sent.message_id] = text.strip()
+        return sent
+
+    async def edit(self, handle: Any, text: str):
+        if text.strip() == self._shown.get(handle.message_id):  # telegram rejects edits that change nothing
+            return
+        with timed("telegram.edit"):
+            try:
+                await handle.edit_text(text)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+        self._shown[handle.message_id] = text.strip()
+
+    async def attach(self, text: str):
+        with timed("telegram.send"):
+            await self.message.reply_document(document=BytesIO(bytes(text, encoding="utf-8")), filename="message.md")
+
+    async def upload(self, text: str) -> str | None:
+        return await paste_service.create_paste(text)
+
+
+async def reply(message: Message, response: AsyncIterator[str]) -> str:
+    if config.stream_replies:
+        return await TelegramReply(
+            message, edit_interval=config.stream_edit_interval, overflow=config.stream_overflow
+        ).consume(response)
+
+    chunks = "".join([r async for r in response])
+    if len(chunks) > MessageLimit.MAX_TEXT_LENGTH and config.stream_overflow == "paste":
+        with timed("telegram.send"):
+            preview, url = await asyncio.gather(
+                message.reply_text(chunks[: MessageLimit.MAX_TEXT_LENGTH]), paste_service.create_paste(chunks)
+            )
+        if url:
+            link = f"\n… {url}"
+            with timed("telegram.edit"):
+                await preview.edit_text(chunks[: MessageLimit.MAX_TEXT_LENGTH - len(link)] + link)
+        else:
+            with timed("telegram.send"):
+                await message.reply_document(document=BytesIO(bytes(chunks, encoding="utf-8")), filename="message.md")
+        return chunks
+    with timed("telegram.send"):
+        if len(chunks) > MessageLimit.MAX_TEXT_LENGTH:
+            await message.reply_document(document=BytesIO(bytes(chunks, encoding="utf-8")), filename="message.md")
+        else:
+            await message.reply_text(chunks)
+    return chunks
+
+
+async def deliver_images(message: Message, jobs: List[asyncio.Task]):
+    """Send the images of background jobs as replies as they finish."""
+    for job in asyncio.as_completed(jobs):
+        try:
+            await message.reply_photo(await job)
+        except Exception as e:
+            await message.reply_text(f"🤖 The image could not be generated: {e}")
+
+
+def allowed(update: Update) -> bool:
+    """Everyone may talk to the bot unless telegram_allowed_users lists user ids or usernames."""
+    user = update.effective_user
+    if not config.telegram_allowed_users:
+        return True
+    return user is not None and (
+        str(user.id) in config.telegram_allowed_users or (user.username or "") in config.telegram_allowed_users
+    )
+
+
+def addressed(message: Message, bot_username: str) -> bool:
+    """In groups, only answer mentions and replies to the bot."""
+    if message.chat.type == ChatType.PRIVATE:
+        return True
+    text = message.text or message.caption or ""
+    replied = message.reply_to_message
+    to_bot = bool(replied and replied.from_user and replied.from_user.username == bot_username)
+    return to_bot or f"@{bot_username}" in text
+
+
+async def photo_urls(message: Message) -> List[str]:
+    """Telegram file urls embed the bot token, so photos are passed on inline."""
+    if not message.photo:
+        return []
+    data = bytes(await (await message.photo[-1].get_file()).download_as_bytearray())
+    return [f"data:{sniff_mime(data) or 'image/jpeg'};base64,{base64.b64encode(data).decode('ascii')}"]
+
+
+async def clear(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_message is None or not allowed(update):
+        return
+    await llmAgent.clear_history(f"telegram-{update.effective_user.id}")  # type: ignore[union-attr]
+    await update.effective_message.reply_text("🤖 Chat history has been reset.")
+
+
+async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    message = update.effective_message
+    if message is None or update.effective_user is None or not allowed(update):
+        return
+    if not addressed(message, context.bot.username):
+        return
+    user_id = f"telegram-{update.effective_user.id}"
+    content = (message.text or message.caption or "").replace(f"@{context.bot.username}", "").strip()
+    if content == "$clear":
+        return await clear(update, context)
+    if not content and message.reply_to_message:
+        content = message.reply_to_message.text or ""
+    try:
+        with timed("telegram.on_message"):
+            async with llmAgent.scheduler.slot(user_id, llmAgent.provider) as wait:
+                stage_seconds.observe(wait, stage="scheduler.wait")
+                await context.bot.send_chat_action(message.chat_id, ChatAction.TYPING)
+                images = await photo_urls(message)
+                if images:
+                    response = llmAgent.query_images(user_id, content, images)
+                else:
+                    response = llmAgent.query(user_id, content)
+                jobs: List[asyncio.Task] = []
+                token = image_deliveries.set(jobs if config.dalle_background else None)
+                try:
+                    chunks = await reply(message, response)
+                finally:
+                    image_deliveries.reset(token)
+                if jobs:
+                    spawn(deliver_images(message, jobs))
+                await llmAgent.save_history(user_id, content, chunks)
+    except SchedulerBusy:
+        await message.reply_text("🤖 I'm busy right now, please try again in a moment.")
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        await message.reply_text(f"🤖 {e}")
+
+
+def build_application() -> Application:
+    # updates are handled concurrently; the scheduler keeps each user's messages in order
+    application = ApplicationBuilder().token(config.telegram_bot_token).concurrent_updates(True).build()
+    application.add_handler(CommandHandler("clear", clear))
+    application.add_handler(MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.PHOTO, on_message))
+    return application
+
+
+async def serve():
+    """Run the bot on the current loop, by webhook when telegram_webhook_url is set and long polling otherwise."""
+    application = build_application()
+    await application.initialize()
+    await start_background()
+    if config.telegram_webhook_url:
+        await application.updater.start_webhook(  # type: ignore[union-attr]
+            listen=config.telegram_webhook_listen,
+            port=config.telegram_webhook_port,
+            url_path=config.telegram_webhook_path,
+            webhook_url=config.telegram_webhook_url,
+            secret_token=config.telegram_webhook_secret or None,
+        )
+    else:
+        await application.updater.start_polling()  # type: ignore[union-attr]
+    await application.start()
+    logger.info(f"Telegram bot @{application.bot.username} started")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await application.updater.stop()  # type: ignore[union-attr]
+        await application.stop()
+        await application.shutdown()
+        await shutdown()
+
+
+def start():
+    asyncio.run(serve())
@@ -0,0 +1,78 @@
+"""An LLM worker: claims jobs the gateway enqueued and replies through the Discord REST api."""
+
+import asyncio
+import logging
+import multiprocessing
+from typing import Set
+
+from app.ai_core.executor import executor, monitor_loop_lag
+from app.ai_core.jobs import JobQueue
+from app.ai_core.metrics import stage_seconds, timed
+from app.ai_core.models import Job
+from app.ai_core.scheduler import SchedulerBusy
+from app.services.core import background, config, llmAgent
+from app.services.discord_bot import bot, job_queue, respond
+from app.services.metrics_server import serve_metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def handle(queue: JobQueue, job: Job):
+    channel = bot.get_partial_messageable(job.channel_id)
+    message = channel.get_partial_message(job.message_id)
+    try:
+        if job.kind == "clear":
+            await llmAgent.clear_history(job.user)
+            await channel.send("🤖 Chat history has been reset.", reference=message)
+            return
+        with timed("worker.job"):
+            async with llmAgent.scheduler.slot(job.user, llmAgent.provider) as wait:
+                stage_seconds.observe(wait, stage="scheduler.wait")
+                async with channel.typing():
+                    await respond(message, job.user, job.content, job.images, job.context)
+    except SchedulerBusy:
+        await channel.send("🤖 I'm busy right now, please try again in a moment.", reference=message)
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        await channel.send(f"🤖 {e}", reference=message)
+    finally:
+        await queue.ack(job)
+
+
+async def work(index: int):
+    if job_queue is None:
+        raise ValueError("Workers need JOB_QUEUE_URL")
+    if multiprocessing.current_process().daemon:  # spawned by the gateway; daemonic processes can't have children
+        executor.configure(config.executor_threads, "thread", config.cpu_executor_workers)
+    executor.install()
+    await bot.login(config.discord_bot_token)  # rest only, the gateway owns the websocket
+    if config.loop_lag_threshold > 0:
+        background.append(asyncio.create_task(monitor_loop_lag(config.loop_lag_threshold)))
+    if config.metrics_port:
+        await serve_metrics(config.metrics_host, config.metrics_port + 1 + index)
+    await llmAgent.warm_up()
+    logger.info(f"Worker {index} ready")
+
+    # claim no more jobs than can run at once, so idle workers get the rest
+    slots = asyncio.Semaphore(config.scheduler_max_in_flight)
+    tasks: Set[asyncio.Task] = set()
+
+    def done(task: asyncio.Task):
+        tasks.discard(task)
+        slots.release()
+
+    while True:
+        await slots.acquire()
+        job = await job_queue.get()
+        task = asyncio.create_task(handle(job_queue, job))
+        tasks.add(task)
+        task.add_done_callback(done)
+
+
+def start(index: int = 0):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s] [%(name)s:%(lineno)s] %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    bot.loop.run_until_complete(work(index))
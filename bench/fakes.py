@@ -0,0 +1,227 @@
+"""Local stand-ins for the LLM provider, the Discord gateway and the tool endpoints."""
+
+import asyncio
+import itertools
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from aiohttp import web
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_ids = itertools.count(1)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers after `ttft` seconds and then streams `tokens` tokens.
+
+    When the agent offers functions and the question mentions the weather or a tweet, it first
+    answers with a function call to the matching tool, like the OpenAI functions API would; when
+    it offers tools, with one tool call per matching tool, like the OpenAI tools API would.
+    """
+
+    ttft: float = 0.3
+    token_interval: float = 0.01
+    tokens: int = 50
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _reply(self, messages: List[BaseMessage], **kwargs: Any) -> AIMessage:
+        last = messages[-1]
+        functions = kwargs.get("functions") or [t["function"] for t in kwargs.get("tools") or []]
+        calls = []
+        if functions and isinstance(last, HumanMessage) and isinstance(last.content, str):
+            for keyword, tool, arg in (
+                ("weather", "weather", "London,GB"),
+                ("tweet", "twitter", "https://x.com/someone/status/1"),
+            ):
+                names = [f["name"] for f in functions if tool in f["name"].lower()]
+                if keyword in last.content.lower() and names:
+                    calls.append({"name": names[0], "arguments": json.dumps({"__arg1": arg})})
+        if calls and "tools" in kwargs:
+            tool_calls = [
+                {"index": i, "id": f"call_{next(_ids)}", "type": "function", "function": call}
+                for i, call in enumerate(calls)
+            ]
+            return AIMessage(content="", additional_kwargs={"tool_calls": tool_calls})
+        if calls:
+            return AIMessage(content="", additional_kwargs={"function_call": calls[0]})
+        return AIMessage(content=" ".join(f"token{i}" for i in range(self.tokens)))
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.ttft + self.tokens * self.token_interval)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, **kwargs))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.ttft + self.tokens * self.token_interval)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, **kwargs))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        reply = self._reply(messages, **kwargs)
+        await asyncio.sleep(self.ttft)
+        if reply.additional_kwargs:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", additional_kwargs=reply.additional_kwargs))
+            return
+        for i, word in enumerate(str(reply.content).split(" ")):
+            if i:
+                await asyncio.sleep(self.token_interval)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if not i else f" {word}"))
+
+
+class FakeUser:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+        self.display_name = name
+
+    def mentioned_in(self, message: Any) -> bool:
+        return True
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeSentMessage:
+    def __init__(self, content: str | None):
+        self.id = next(_ids)
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content: str | None = None, **kwargs: Any):
+        self.content = content
+        self.edits += 1
+
+
+class FakeChannel:
+    """Records what the bot sends, and when the first message went out."""
+
+    def __init__(self, send_latency: float = 0.05):
+        self.id = next(_ids)
+        self.send_latency = send_latency
+        self.sent: List[FakeSentMessage] = []
+        self.first_send_at: float | None = None
+
+    @asynccontextmanager
+    async def _typing(self) -> AsyncIterator[None]:
+        yield
+
+    def typing(self) -> Any:
+        return self._typing()
+
+    async def send(self, content: str | None = None, **kwargs: Any) -> FakeSentMessage:
+        await asyncio.sleep(self.send_latency)
+        if self.first_send_at is None:
+            self.first_send_at = time.monotonic()
+        m = FakeSentMessage(content)
+        self.sent.append(m)
+        return m
+
+    async def fetch_message(self, id: int) -> FakeSentMessage:
+        await asyncio.sleep(self.send_latency)
+        return FakeSentMessage("fetched")
+
+
+class FakeMessage:
+    """Just enough of nextcord.Message for on_message."""
+
+    def __init__(self, author: FakeUser, content: str, channel: FakeChannel):
+        self.id = next(_ids)
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.guild = None
+        self.role_mentions: List[Any] = []
+        self.attachments: List[Any] = []
+        self.reference = None
+        self.mention_everyone = False
+        self.created_at = time.monotonic()
+
+    async def add_reaction(self, emoji: str):
+        pass
+
+
+class RewriteTransport(httpx.AsyncBaseTransport):
+    """Sends every request to `target` instead of the host in its url."""
+
+    def __init__(self, target: str):
+        self.target = httpx.URL(target)
+        self._inner = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self.target.scheme, host=self.target.host, port=self.target.port)
+        return await self._inner.handle_async_request(request)
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+@asynccontextmanager
+async def stub_tool_server(latency: float = 0.1) -> AsyncIterator[str]:
+    """Serve canned openweathermap, fxtwitter and pastebin responses on a local port, yielding its base url."""
+
+    async def weather(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        return web.json_response(
+            {
+                "weather": [{"description": "light rain"}],
+                "main": {"temp": 12.3, "temp_max": 14.0, "temp_min": 10.1, "feels_like": 11.0, "humidity": 81},
+                "wind": {"speed": 4.1, "deg": 230},
+                "clouds": {"all": 75},
+            }
+        )
+
+    async def tweet(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        return web.Response(
+            text='<meta property="og:title" content="someone"><meta property="og:description" content="hello">',
+            content_type="text/html",
+        )
+
+    async def paste(request: web.Request) -> web.Response:
+        await request.post()
+        await asyncio.sleep(latency)
+        return web.Response(text=f"{request.url.origin()}/paste/{next(_ids)}\n")
+
+    app = web.Application()
+    app.router.add_post("/api/", paste)
+    app.router.add_get("/data/2.5/weather", weather)
+    app.router.add_get("/{user}/status/{id}", tweet)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+def tool_mounts(base_url: str) -> Dict[str, httpx.AsyncBaseTransport]:
+    transport = RewriteTransport(base_url)
+    return {"https://api.openweathermap.org": transport, "https://fxtwitter.com": transport}
@@ -0,0 +1,199 @@
+"""Offline load test: drives on_message end to end against a fake provider, gateway and tool endpoints.
+
+    python -m bench.run --users 1000 --messages 2 --concurrency 100
+    python -m bench.run --save-baseline bench/baseline.json
+    python -m bench.run --baseline bench/baseline.json --tolerance 0.2  # exits 1 on regressions
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+parser = argparse.ArgumentParser(description="Benchmark the bot against local stand-ins.")
+parser.add_argument("--users", type=int, default=200)
+parser.add_argument("--messages", type=int, default=2, help="messages per user")
+parser.add_argument("--concurrency", type=int, default=50, help="messages in flight at once")
+parser.add_argument("--ttft", type=float, default=0.3, help="fake model time to first token")
+parser.add_argument("--tokens", type=int, default=50, help="tokens per fake answer")
+parser.add_argument("--token-interval", type=float, default=0.01)
+parser.add_argument("--tool-ratio", type=float, default=0.2, help="share of messages that trigger a tool call")
+parser.add_argument("--tool-latency", type=float, default=0.1)
+parser.add_argument("--env", action="append", default=[], help="extra Settings as KEY=VALUE")
+parser.add_argument("--baseline", type=str, help="fail when worse than this baseline")
+parser.add_argument("--save-baseline", type=str, help="write the results as a new baseline")
+parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+parser.add_argument("--seed", type=int, default=0)
+
+# metric -> True when higher is better
+METRICS = {
+    "latency_p50": False,
+    "latency_p95": False,
+    "latency_p99": False,
+    "ttft_p50": False,
+    "ttft_p95": False,
+    "throughput": True,
+    "loop_lag_max": False,
+    "rss_mib_per_1k_users": False,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def rss_mib() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def monitor_loop_lag(lags: List[float], interval: float = 0.01):
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(time.monotonic() - started - interval)
+
+
+def setup(args: argparse.Namespace):
+    """Point the bot at the fakes; must run before app.services.discord_bot is imported."""
+    os.environ.update(
+        {
+            "OPENAI_API_KEY": "fake",
+            "OPENWEATHERMAP_API_KEY": "fake",
+            "ENABLE_TWITTER_TRANSLATOR": "true",
+            "HISTORY_MAX_USERS": str(max(args.users, 1)),
+        }
+    )
+    os.environ.update(kv.split("=", 1) for kv in args.env)
+
+    from app.ai_core import agents
+    from app.ai_core.tokens import approximate_counter
+    from bench.fakes import FakeChatModel
+
+    def fake_model(config):
+        return FakeChatModel(ttft=args.ttft, tokens=args.tokens, token_interval=args.token_interval)
+
+    agents.text_models["openai"] = (lambda config: config.is_openai, fake_model)
+    agents.vision_models["openai"] = (lambda config: config.is_openai, fake_model)
+    agents.dalle_model_from_config = lambda config: None
+    agents.token_counter_from_config = lambda config: approximate_counter()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    import app.services.discord_bot as discord_bot
+    from app.ai_core.http_client import http_client
+    from bench.fakes import FakeChannel, FakeMessage, FakeUser, stub_tool_server, tool_mounts
+
+    rng = random.Random(args.seed)
+    discord_bot.bot._connection.user = FakeUser("bot")  # type: ignore[assignment]
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    lags: List[float] = []
+    busy = 0
+
+    async with stub_tool_server(args.tool_latency) as base_url:
+        http_client.mounts = tool_mounts(base_url)
+        discord_bot.paste_service.endpoint = f"{base_url}/api/"
+        await discord_bot.llmAgent.warm_up()
+        users = [FakeUser(f"user{i}") for i in range(args.users)]
+        jobs = [u for u in users for _ in range(args.messages)]
+        rng.shuffle(jobs)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def send(user: FakeUser):
+            nonlocal busy
+            r = rng.random()
+            if r < args.tool_ratio / 3:
+                text = "what's the weather in London?"
+            elif r < args.tool_ratio * 2 / 3:
+                text = "translate this tweet https://x.com/someone/status/1"
+            elif r < args.tool_ratio:
+                text = "what's the weather in London, and translate this tweet https://x.com/someone/status/1"
+            else:
+                text = f"tell me something about number {rng.randint(0, 10**6)}"
+            async with semaphore:
+                channel = FakeChannel()
+                message = FakeMessage(user, f"<@bot> {text}", channel)
+                started = time.monotonic()
+                await discord_bot.on_message(message)  # type: ignore[arg-type]
+                latencies.append(time.monotonic() - started)
+                if channel.first_send_at is not None:
+                    ttfts.append(channel.first_send_at - started)
+                if channel.sent and (channel.sent[0].content or "").startswith("🤖 I'm busy"):
+                    busy += 1
+
+        rss_before = rss_mib()
+        lag_task = asyncio.create_task(monitor_loop_lag(lags))
+        started = time.monotonic()
+        await asyncio.gather(*[send(u) for u in jobs])
+        elapsed = time.monotonic() - started
+        lag_task.cancel()
+        rss_after = rss_mib()
+        await discord_bot.shutdown()
+
+    return {
+        "messages": len(latencies),
+        "busy_replies": busy,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "loop_lag_mean": statistics.fmean(lags) if lags else 0.0,
+        "loop_lag_p99": percentile(lags, 99),
+        "loop_lag_max": max(lags, default=0.0),
+        "rss_mib_per_1k_users": (rss_after - rss_before) / max(args.users, 1) * 1000,
+    }
+
+
+def regressions(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    failed = []
+    for name, higher_is_better in METRICS.items():
+        if name not in baseline:
+            continue
+        was, now = baseline[name], results[name]
+        if higher_is_better:
+            worse = now < was * (1 - tolerance)
+        else:  # ignore sub-5ms noise on tiny values
+            worse = now > was * (1 + tolerance) and now - was > 0.005
+        if worse:
+            failed.append(f"{name}: {now:.4f} vs baseline {was:.4f}")
+    return failed
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="[%(levelname)s] [%(name)s] %(message)s")
+    setup(args)
+    results = asyncio.run(run(args))
+    for name, value in results.items():
+        print(f"{name:24} {value:.4f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed = regressions(results, json.load(f), args.tolerance)
+        for line in failed:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,77 @@
 import argparse
+import asyncio
+import builtins
 import logging
+import multiprocessing
+import resource
+import sys
+import time
+from typing import Dict, List
 
 import dotenv
 
 parser = argparse.ArgumentParser(description="Run a bot.")
 parser.add_argument("-env-file", type=str, help="env file", default=".env")
+parser.add_argument("--profile-startup", action="store_true", help="log startup and per-package import times")
+parser.add_argument(
+    "--role",
+    choices=["bot", "worker"],
+    default="bot",
+    help="bot: the discord gateway (answering itself, or enqueueing with JOB_QUEUE_URL); worker: answer queued jobs",
+)
+parser.add_argument("--worker-index", type=int, default=0, help=argparse.SUPPRESS)
+parser.add_argument(
+    "--frontend",
+    choices=["discord", "telegram"],
+    action="append",
+    help="front ends to run in this process, sharing one agent; repeat for several (default: discord)",
+)
 args = parser.parse_args()
 
+
+def profile_imports() -> Dict[str, float]:
+    """Record the self time of every top-level package imported from now on, by package name."""
+    timings: Dict[str, float] = {}
+    nested: List[float] = []
+    original_import = builtins.__import__
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        top = name.partition(".")[0]
+        if level or top in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            timings[top] = timings.get(top, 0.0) + elapsed - nested.pop()
+            if nested:
+                nested[-1] += elapsed
+
+    builtins.__import__ = timed_import
+    return timings
+
+
+def spawn_workers(n: int) -> List[multiprocessing.process.BaseProcess]:
+    """Start `n` worker processes on this host, which exit along with this one."""
+    from app.services import worker
+
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=worker.start, args=(i,), name=f"worker-{i}", daemon=True) for i in range(n)]
+    for p in processes:
+        p.start()
+    return processes
+
+
+def report_startup(started: float, timings: Dict[str, float]):
+    logger = logging.getLogger("startup")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024  # kilobytes on linux
+    logger.info("bot ready to connect after %.2fs, max rss %d MiB", time.perf_counter() - started, rss)
+    for name, seconds in sorted(timings.items(), key=lambda x: -x[1])[:25]:
+        logger.info("  import %-32s %.3fs", name, seconds)
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
@@ -14,6 +79,28 @@ if __name__ == "__main__":
         datefmt="%Y-%m-%d %H:%M:%S",
     )
     dotenv.load_dotenv(dotenv_path=args.env_file)
-    import app.services.discord_bot as discord_bot
+    started = time.perf_counter()
+    timings = profile_imports() if args.profile_startup else {}
+    if args.role == "worker":
+        from app.services import worker
+
+        worker.start(args.worker_index)
+        sys.exit()
+
+    frontends = set(args.frontend or ["discord"])
+    if "discord" in frontends:
+        import app.services.discord_bot as discord_bot
+    if "telegram" in frontends:
+        import app.services.telegram_bot as telegram_bot
+
+    if args.profile_startup:
+        report_startup(started, timings)
 
-    discord_bot.start()
+    if "discord" in frontends and discord_bot.job_queue is not None and discord_bot.config.bot_workers:
+        spawn_workers(discord_bot.config.bot_workers)
+    if frontends == {"discord"}:
+        discord_bot.start()
+    elif frontends == {"telegram"}:
+        telegram_bot.start()
+    else:  # both share one agent, on the loop nextcord bound its client to
+        discord_bot.bot.loop.run_until_complete(asyncio.gather(discord_bot.serve(), telegram_bot.serve()))